@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: bench_aimd.py
+# Script Purpose: Check that the adaptive download concurrency grows while
+#   throughput improves and backs off on server errors, against a local
+#   server with bandwidth caps and an error rate
+##############################################################################
+
+import argparse
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import hlsdownloader.hlsdownloader as hls
+from hlsdownloader.connection import ConnectionPool
+from hlsdownloader.controller import AIMDController
+from hlsdownloader.transfer import fetch
+from hls_fixture import TILES, YEARS, make_tree, serve
+
+
+def main():
+    pargs = argparse.ArgumentParser(
+        description="Check AIMD concurrency against a capped, flaky server"
+    )
+    pargs.add_argument("-w", "--workers", type=int, default=32)
+    pargs.add_argument("-i", "--initial-workers", type=int, default=2)
+    pargs.add_argument(
+        "--interval", type=float, default=1.0, help="Seconds per window"
+    )
+    pargs.add_argument(
+        "-b", "--bandwidth", type=float, default=5e6, help="Bytes/s per connection"
+    )
+    pargs.add_argument(
+        "-t",
+        "--total-bandwidth",
+        type=float,
+        default=40e6,
+        help="Bytes/s across connections",
+    )
+    pargs.add_argument(
+        "-e",
+        "--error-rate",
+        type=float,
+        default=0.01,
+        help="Fraction of file requests answered with 503",
+    )
+    pargs.add_argument(
+        "-s", "--size", type=int, default=2_000_000, help="Bytes per file"
+    )
+    args = pargs.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        make_tree(root / "server", days=[1, 100, 200], size=args.size)
+        server, hls.URL = serve(
+            root / "server",
+            total_bandwidth=args.total_bandwidth,
+            latency=0.01,
+            bandwidth=args.bandwidth,
+            error_rate=args.error_rate,
+        )
+        dir_urls = hls.construct_dir_urls(hls.SENSORS, TILES, YEARS)
+        urls = [
+            url for url in hls.construct_file_urls(dir_urls) if url.endswith(".hdf")
+        ]
+        print(
+            f"{len(urls)} files of {args.size / 1e6:g} MB, "
+            f"{args.bandwidth / 1e6:g} MB/s per connection, "
+            f"{args.total_bandwidth / 1e6:g} MB/s total, "
+            f"{args.error_rate:.0%} errors"
+        )
+
+        start = time.monotonic()
+        changes = []
+
+        def log(limit, rate, reason):
+            changes.append((limit, reason))
+            print(
+                f"{time.monotonic() - start:5.1f}s limit={limit:2d} "
+                f"{rate / 1e6:5.1f} MB/s {reason}"
+            )
+
+        controller = AIMDController(
+            args.workers, args.initial_workers, interval=args.interval, log=log
+        )
+        pool = ConnectionPool(maxsize=args.workers)
+        outdir = root / "out"
+        outdir.mkdir()
+
+        def download(url):
+            with controller:
+                fetch(
+                    pool,
+                    url,
+                    outdir / url.split("/")[-1],
+                    retries=5,
+                    controller=controller,
+                )
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(download, urls))
+        elapsed = time.monotonic() - start
+        pool.close()
+        server.shutdown()
+
+    print(f"{len(urls) * args.size / 1e6 / elapsed:.1f} MB/s overall")
+    limits = [limit for limit, _ in changes]
+    backoffs = [i for i, (_, reason) in enumerate(changes) if "backoff" in reason]
+    assert max(limits, default=0) > args.initial_workers, "limit never grew"
+    if args.error_rate:
+        assert backoffs, "limit never backed off"
+        assert any(
+            limits[i] < limits[i + 1] for i in range(backoffs[0], len(limits) - 1)
+        ), "limit never grew again after backing off"
+    print(f"peak limit {max(limits)}, {len(backoffs)} backoffs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: bench_download.py
+# Script Purpose: Compare files/s and MB/s of urlretrieve in a process pool
+#   with worker threads sharing a pool of keep-alive connections
+##############################################################################
+
+import argparse
+import multiprocessing as mp
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.request import urlretrieve
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import hlsdownloader.hlsdownloader as hls
+from hlsdownloader.connection import ConnectionPool
+from hlsdownloader.transfer import fetch
+from hls_fixture import TILES, YEARS, make_tree, serve
+
+
+def retrieve(args: tuple) -> None:
+    url, outdir = args
+    urlretrieve(url, Path(outdir) / url.split("/")[-1])
+
+
+def process_pool(urls: list, outdir: Path, workers: int) -> None:
+    """
+    Downloading as it was done before, urlretrieve in a multiprocessing pool
+    """
+    with mp.Pool(workers) as pool:
+        pool.map(retrieve, [(url, outdir) for url in urls])
+
+
+def thread_pool(urls: list, outdir: Path, workers: int) -> None:
+    pool = ConnectionPool(maxsize=workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(
+            executor.map(
+                lambda url: fetch(pool, url, outdir / url.split("/")[-1]), urls
+            )
+        )
+    pool.close()
+
+
+def main():
+    pargs = argparse.ArgumentParser(
+        description="Compare downloads in a process pool and a thread pool"
+    )
+    pargs.add_argument(
+        "-l", "--latency", type=float, default=0.02, help="Seconds per request"
+    )
+    pargs.add_argument(
+        "-s", "--size", type=int, default=1_000_000, help="Bytes per file"
+    )
+    pargs.add_argument("-w", "--workers", type=int, nargs="+", default=[4, 8])
+    args = pargs.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        make_tree(root / "server", size=args.size)
+        server, hls.URL = serve(root / "server", latency=args.latency)
+        dir_urls = hls.construct_dir_urls(hls.SENSORS, TILES, YEARS)
+        urls = [
+            url for url in hls.construct_file_urls(dir_urls) if url.endswith(".hdf")
+        ]
+        megabytes = len(urls) * args.size / 1e6
+        print(
+            f"{len(urls)} files of {args.size / 1e6:g} MB, "
+            f"{args.latency * 1000:.0f} ms latency"
+        )
+
+        outdir = root / "out"
+        for workers in args.workers:
+            for label, download in [
+                ("mp.Pool+urlretrieve", process_pool),
+                ("threads+pool", thread_pool),
+            ]:
+                shutil.rmtree(outdir, ignore_errors=True)
+                outdir.mkdir()
+                start = time.perf_counter()
+                download(urls, outdir, workers)
+                elapsed = time.perf_counter() - start
+                assert len(list(outdir.iterdir())) == len(urls)
+                print(
+                    f"{label:20s} n={workers}: {len(urls) / elapsed:6.1f} files/s "
+                    f"{megabytes / elapsed:6.1f} MB/s"
+                )
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
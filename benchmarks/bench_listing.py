@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: bench_listing.py
+# Script Purpose: Time serial and concurrent HLS directory listings against
+#   a local server adding a fixed latency to every request
+##############################################################################
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.request import urlopen
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import hlsdownloader.hlsdownloader as hls
+from hls_fixture import TILES, YEARS, make_tree, serve
+
+
+def serial_file_urls(dir_urls: list) -> list:
+    """
+    Listing as it was done before, one urlopen per directory in turn
+    """
+    file_paths = []
+    for url in dir_urls:
+        file_list = hls.regex.findall(urlopen(url).read().decode())
+        file_paths.extend(hls.granule_urls(url, file_list))
+    return file_paths
+
+
+def main():
+    pargs = argparse.ArgumentParser(
+        description="Compare serial and concurrent directory listings"
+    )
+    pargs.add_argument(
+        "-l", "--latency", type=float, default=0.05, help="Seconds per request"
+    )
+    pargs.add_argument(
+        "-c", "--concurrency", type=int, nargs="+", default=[1, 8, 32]
+    )
+    args = pargs.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(Path(root), size=10)
+        server, hls.URL = serve(Path(root), latency=args.latency)
+        dir_urls = hls.construct_dir_urls(hls.SENSORS, TILES, YEARS)
+        print(f"{len(dir_urls)} directories, {args.latency * 1000:.0f} ms latency")
+
+        start = time.perf_counter()
+        expected = serial_file_urls(dir_urls)
+        print(f"serial urlopen   {time.perf_counter() - start:6.2f}s")
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            file_paths = hls.construct_file_urls(dir_urls, concurrency)
+            elapsed = time.perf_counter() - start
+            assert file_paths == expected, "listings differ from serial urlopen"
+            print(f"{concurrency:3d} workers      {elapsed:6.2f}s")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
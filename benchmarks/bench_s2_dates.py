@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: bench_s2_dates.py
+# Script Purpose: Time selecting S2 products by sensing date on synthetic
+#   product names, scanning every name for every day as S2_downloader used
+#   to against comparing the sensing date in each name once
+##############################################################################
+
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "s2downloader"))
+
+import S2_downloader as s2
+from scheduler import FOLDER_SUFFIX
+
+##############
+# Constants
+TILES = [
+    f"{zone}S{square}"
+    for zone in (16, 17, 18)
+    for square in ("PA", "PB", "PC", "QA", "QB", "QC", "RA", "RB", "RC", "SA")
+]
+RANGES = [
+    ("2020-06-01", "2020-06-15"),
+    ("2020-01-01", "2021-01-01"),
+    ("2019-01-01", "2022-01-01"),
+]
+
+
+def product_urls(count: int, tiles: list) -> list:
+    """
+    Random product urls from 2017 to 2023, one list per tile. Every tenth
+    product also has a folder placeholder object, as some buckets do.
+    """
+    rng = random.Random(0)
+    start = datetime(2017, 1, 1)
+    urls = [[] for _ in tiles]
+    for i in range(count):
+        tile = tiles[i % len(tiles)]
+        sensing = start + timedelta(seconds=rng.randrange(7 * 365 * 86400))
+        processed = sensing + timedelta(days=rng.randrange(3))
+        url = (
+            f"{s2.URL}/{tile[0:2]}/{tile[2]}/{tile[3:5]}/S2{'AB'[i % 2]}_MSIL2A_"
+            f"{sensing:%Y%m%dT%H%M%S}_N0{rng.choice([204, 212, 400, 509])}_"
+            f"R{rng.randrange(1, 143):03d}_T{tile}_{processed:%Y%m%dT%H%M%S}.SAFE"
+        )
+        urls[i % len(tiles)].append(f"{url}/")
+        if i % 10 == 0:
+            urls[i % len(tiles)].append(f"{url}{FOLDER_SUFFIX}")
+    return urls
+
+
+def scan_by_date(start_date: str, end_date: str, file_urls: list) -> list:
+    """
+    Selection as it was done before: every day of the range is searched for
+    as a substring of every url
+    """
+    sdate = date.fromisoformat(start_date)
+    days = (date.fromisoformat(end_date) - sdate).days
+    date_char = [(sdate + timedelta(days=i)).strftime("%Y%m%d") for i in range(days)]
+    tile_links = []
+    for s2_links in file_urls:
+        tile_links.append([j for i in date_char for j in s2_links if i in j])
+    return tile_links
+
+
+def main():
+    pargs = argparse.ArgumentParser(
+        description="Compare substring scans and name comparisons for S2 date selection"
+    )
+    pargs.add_argument("-n", "--names", type=int, default=100_000)
+    pargs.add_argument(
+        "--scan-limit",
+        type=int,
+        default=400,
+        help="Skip the substring scan for ranges longer than this many days",
+    )
+    args = pargs.parse_args()
+
+    urls = product_urls(args.names, TILES)
+    print(f"{args.names} products over {len(TILES)} tiles")
+    print(f"{'range':24s} {'scan':>10s} {'compare':>10s} {'products':>9s}")
+    for start, end in RANGES:
+        days = (date.fromisoformat(end) - date.fromisoformat(start)).days
+        scan = "-"
+        if days <= args.scan_limit:
+            begin = time.perf_counter()
+            scan_by_date(start, end, urls)
+            scan = f"{(time.perf_counter() - begin) * 1000:.0f} ms"
+
+        begin = time.perf_counter()
+        products = s2.query_by_date(start, end, urls)
+        elapsed = time.perf_counter() - begin
+        count = sum(len(tile) for tile in products)
+        assert all(
+            not p.url.endswith(FOLDER_SUFFIX)
+            for tile in products
+            for p in tile
+        ), "folder placeholder parsed as a product"
+        print(f"{start}..{end}   {scan:>10s} {elapsed * 1000:7.0f} ms {count:9d}")
+
+
+if __name__ == "__main__":
+    main()
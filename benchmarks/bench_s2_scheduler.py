@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: bench_s2_scheduler.py
+# Script Purpose: Compare downloading S2 products one after another, each
+#   through its own pool, with the shared transfer scheduler, against a
+#   fake bucket served with a fixed latency per request
+##############################################################################
+
+import argparse
+import contextlib
+import io
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "s2downloader"))
+
+import S2_downloader as s2
+from scheduler import WORKERS, download_products
+from gcs_fixture import TILES, FixtureClient, make_bucket, serve
+
+
+def per_product(host: str, products: list, outdir: Path, workers: int) -> dict:
+    """
+    Downloading as it was done before, minus the gsutil start up: products
+    in turn, each with a fresh client and pool of workers
+    """
+    stats = {"objects": 0, "bytes": 0}
+    for product in products:
+        result = download_products(FixtureClient(host), [product], outdir, workers, 1)
+        stats["objects"] += result["objects"]
+        stats["bytes"] += result["bytes"]
+    return stats
+
+
+def shared(host: str, products: list, outdir: Path, workers: int) -> dict:
+    return download_products(FixtureClient(host), products, outdir, workers)
+
+
+def main():
+    pargs = argparse.ArgumentParser(
+        description="Compare per-product pools with the shared S2 scheduler"
+    )
+    pargs.add_argument(
+        "-l", "--latency", type=float, default=0.05, help="Seconds per request"
+    )
+    pargs.add_argument("-w", "--workers", type=int, default=WORKERS)
+    pargs.add_argument(
+        "--scale", type=float, default=0.25, help="Size of the images, 1 is real"
+    )
+    args = pargs.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        make_bucket(root / "bucket", scale=args.scale)
+        server, host = serve(root / "bucket", latency=args.latency)
+        urls = s2.construct_file_urls(
+            TILES, FixtureClient(host), 8, "2021-06-01", "2021-07-01"
+        )
+        subset = s2.query_by_date("2021-06-01", "2021-07-01", urls)
+        products = s2.flatten_products(subset, TILES)
+        print(f"{len(products)} products, {args.latency * 1000:.0f} ms latency")
+
+        outdir = root / "out"
+        for label, download in [
+            ("per-product pools", per_product),
+            ("shared pool", shared),
+        ]:
+            shutil.rmtree(outdir, ignore_errors=True)
+            for tile in TILES:
+                (outdir / tile).mkdir(parents=True)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = download(host, products, outdir, args.workers)
+            elapsed = time.perf_counter() - start
+            assert len(list(outdir.glob("*/*.SAFE"))) == len(products)
+            print(
+                f"{label:18s} {stats['objects']} objects {stats['bytes'] / 1e6:.0f} MB "
+                f"{elapsed:6.2f}s {stats['objects'] / elapsed:5.0f} obj/s "
+                f"{stats['bytes'] / 1e6 / elapsed:5.0f} MB/s"
+            )
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: gcs_fixture.py
+# Script Purpose: Local stand-in for the Google Cloud Storage JSON API
+#   serving a directory as buckets, used by the S2 benchmarks
+##############################################################################
+
+import argparse
+import http.client
+import http.server
+import json
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "s2downloader"))
+
+from storage import GCSClient
+
+##############
+# Constants
+BUCKET = "gcp-public-data-sentinel-2"
+TILES = ["17SPA", "17SPB", "18SUJ"]
+PAGE_SIZE = 1000
+# Images per resolution folder and their approximate size in bytes
+IMAGES = {"R10m": (7, 1_500_000), "R20m": (13, 500_000), "R60m": (15, 80_000)}
+
+
+def make_bucket(
+    root: Path, tiles: list = TILES, days: int = 10, scale: float = 1.0
+) -> None:
+    """
+    Write ``days`` products from June 2021 per tile into ``root/BUCKET``,
+    laid out like L2A products with metadata files, masks, images at three
+    resolutions and folder placeholder objects. ``scale`` shrinks the images.
+    """
+    rng = random.Random(1)
+    for tile in tiles:
+        for day in range(1, days + 1):
+            name = (
+                f"S2A_MSIL2A_202106{day:02d}T160901_N0300_R140_T{tile}_"
+                f"202106{day:02d}T201515.SAFE"
+            )
+            base = Path(root, BUCKET, "L2/tiles", tile[0:2], tile[2], tile[3:5], name)
+            granule = base / "GRANULE" / f"L2A_T{tile}_A000001_202106{day:02d}T161000"
+            files = {
+                base / "MTD_MSIL2A.xml": 50_000,
+                base / "manifest.safe": 20_000,
+                base / "INSPIRE.xml": 15_000,
+                base / "GRANULE_$folder$": 0,
+                granule / "MTD_TL.xml": 600_000,
+            }
+            for i in range(8):
+                path = base / "DATASTRIP" / "DS" / "QI_DATA" / f"report_{i}.xml"
+                files[path] = rng.randint(2_000, 40_000)
+            for i in range(20):
+                path = granule / "QI_DATA" / f"MSK_{i}.jp2"
+                files[path] = int(rng.randint(5_000, 300_000) * scale)
+            for resolution, (count, size) in IMAGES.items():
+                for i in range(count):
+                    path = (
+                        granule / "IMG_DATA" / resolution /
+                        f"T{tile}_B{i:02d}_{resolution[1:]}.jp2"
+                    )
+                    files[path] = int((size + rng.randint(0, 100_000)) * scale)
+            for path, size in files.items():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(os.urandom(size))
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers object listings, with or without a delimiter, and media
+    downloads of the JSON API from ``root``, waiting ``latency`` seconds
+    before every response
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    root = "."
+    latency = 0.05
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        # /storage/v1/b/<bucket>/o[/<object>]
+        parts = url.path.split("/")
+        bucket = Path(self.root, unquote(parts[4]))
+        if len(parts) > 6 and parts[6]:
+            return self.send_object(bucket / unquote(parts[6]))
+        self.send_listing(
+            bucket,
+            query["prefix"][0],
+            query.get("delimiter", [None])[0],
+            int(query.get("pageToken", ["0"])[0]),
+        )
+
+    def send_object(self, path: Path) -> None:
+        if not path.is_file():
+            return self.send_json(404, {})
+        self.send_response(200)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def send_listing(self, bucket: Path, prefix: str, delimiter: str, start: int):
+        directory = prefix[: prefix.rfind("/") + 1]
+        items = []
+        prefixes = set()
+        for dirpath, _, filenames in os.walk(bucket / directory):
+            for filename in filenames:
+                path = Path(dirpath, filename)
+                name = path.relative_to(bucket).as_posix()
+                if not name.startswith(prefix):
+                    continue
+                rest = name[len(directory) :]
+                if delimiter and delimiter in rest:
+                    prefixes.add(directory + rest.split(delimiter)[0] + delimiter)
+                else:
+                    stat = path.stat()
+                    items.append(
+                        {
+                            "name": name,
+                            "size": str(stat.st_size),
+                            "generation": str(stat.st_mtime_ns // 1000),
+                        }
+                    )
+        items.sort(key=lambda item: item["name"])
+        page = {
+            "items": items[start : start + PAGE_SIZE],
+            "prefixes": sorted(prefixes),
+        }
+        if start + PAGE_SIZE < len(items):
+            page["nextPageToken"] = str(start + PAGE_SIZE)
+        self.send_json(200, page)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FixtureClient(GCSClient):
+    """
+    GCSClient talking plain HTTP to a fixture server
+
+    Args:
+        host: host:port of the server
+    """
+
+    def __init__(self, host: str, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = http.client.HTTPConnection(
+                self.host, timeout=self.timeout
+            )
+        return self._local.conn
+
+
+def serve(root: Path, port: int = 0, latency: float = 0.05) -> tuple:
+    """
+    Serve the buckets in ``root`` from a background thread
+
+    Returns:
+        tuple: The server, to shut down, and its host:port
+    """
+    handler = type(
+        "FixtureHandler", (Handler,), {"root": str(root), "latency": latency}
+    )
+    server = Server(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    pargs = argparse.ArgumentParser(description="Serve a fake S2 bucket locally")
+    pargs.add_argument("root", help="Directory of the buckets, written if missing")
+    pargs.add_argument("-p", "--port", type=int, default=8793)
+    pargs.add_argument(
+        "-l", "--latency", type=float, default=0.05, help="Seconds per request"
+    )
+    args = pargs.parse_args()
+
+    root = Path(args.root)
+    if not (root / BUCKET).exists():
+        make_bucket(root)
+    server, host = serve(root, args.port, args.latency)
+    print(f"Serving http://{host}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
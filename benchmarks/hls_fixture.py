@@ -0,0 +1,248 @@
+#! /usr/bin/env python3
+##############################################################################
+# Title: hls_fixture.py
+# Script Purpose: Local stand-in for the HLS server, used by the benchmarks
+##############################################################################
+
+import argparse
+import http.server
+import io
+import os
+import random
+import re
+import socketserver
+import threading
+import time
+from pathlib import Path
+
+##############
+# Constants
+TILES = [f"17S{a}{b}" for a in "PQR" for b in "ABCD"]
+YEARS = [2015, 2016, 2017]
+DAYS = [1, 100]
+PREFIX = "data/v1.4"
+
+
+def make_tree(
+    root: Path,
+    tiles: list = TILES,
+    years: list = YEARS,
+    days: list = DAYS,
+    size: int = 1000,
+) -> None:
+    """
+    Write an HLS directory tree with one S30 and one L30 granule, and their
+    .hdr files, per tile, year and day of year
+    """
+    for sensor in ["S30", "L30"]:
+        for year in years:
+            for tile in tiles:
+                directory = Path(
+                    root, PREFIX, sensor, str(year), tile[0:2], tile[2], tile[3],
+                    tile[4]
+                )
+                directory.mkdir(parents=True, exist_ok=True)
+                for day in days:
+                    name = f"HLS.{sensor}.T{tile}.{year}{day:03d}.v1.4.hdf"
+                    (directory / name).write_bytes(os.urandom(size))
+                    (directory / f"{name}.hdr").write_text("hdr\n")
+
+
+class Throttle:
+    """
+    Bandwidth shared by all connections of a server
+
+    Args:
+        rate: Bytes per second
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self, nbytes: int) -> None:
+        """
+        Sleep until ``nbytes`` more fit within the rate
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(now, self._next) + nbytes / self.rate
+            delay = self._next - now
+        time.sleep(delay)
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves directory listings in the format of the HLS server and files with
+    range requests, waiting ``latency`` seconds before every response.
+
+    Files are sent at up to ``bandwidth`` bytes per second per connection
+    and ``throttle`` across connections, and ``error_rate`` of the requests
+    for files are answered with 503.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.05
+    bandwidth = 0
+    throttle = None
+    error_rate = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def empty(self, status: int, headers: dict = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_head(self):
+        time.sleep(self.latency)
+        self.remaining = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            etag = '"%d"' % int(os.stat(path).st_mtime)
+            if self.headers.get("If-None-Match") == etag:
+                self.empty(304)
+                return None
+            body = "".join(
+                f'<a href="{n}">{n}</a>\n' for n in sorted(os.listdir(path))
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return io.BytesIO(body)
+        if not os.path.isfile(path):
+            self.empty(404)
+            return None
+        if random.random() < self.error_rate:
+            self.empty(503)
+            return None
+
+        size = os.path.getsize(path)
+        f = open(path, "rb")
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            self.remaining = size
+            return f
+        first = int(match.group(1))
+        last = min(int(match.group(2) or size - 1), size - 1)
+        if first >= size:
+            f.close()
+            self.empty(416, {"Content-Range": f"bytes */{size}"})
+            return None
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        f.seek(first)
+        self.remaining = last - first + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = self.remaining
+        while remaining is None or remaining > 0:
+            chunk = source.read(65536 if remaining is None else min(65536, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            if self.bandwidth:
+                time.sleep(len(chunk) / self.bandwidth)
+            if self.throttle is not None:
+                self.throttle.wait(len(chunk))
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def serve(
+    root: Path,
+    port: int = 0,
+    handler=Handler,
+    total_bandwidth: float = 0,
+    **settings,
+) -> tuple:
+    """
+    Serve ``root`` from a background thread
+
+    Args:
+        root
+        port: 0 to pick a free port
+        handler: Request handler class
+        total_bandwidth: Bytes per second across all connections
+        **settings: Handler attributes to override, e.g. latency
+
+    Returns:
+        tuple: The server, to shut down, and the url of the HLS data
+    """
+    if total_bandwidth:
+        settings["throttle"] = Throttle(total_bandwidth)
+    handler = type("FixtureHandler", (handler,), settings)
+    server = Server(
+        ("127.0.0.1", port),
+        lambda *args: handler(*args, directory=str(root)),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/{PREFIX}"
+
+
+def main():
+    pargs = argparse.ArgumentParser(description="Serve a fake HLS tree locally")
+    pargs.add_argument("root", help="Directory of the tree, written if missing")
+    pargs.add_argument("-p", "--port", type=int, default=8765)
+    pargs.add_argument(
+        "-l", "--latency", type=float, default=0.05, help="Seconds per request"
+    )
+    pargs.add_argument(
+        "-b", "--bandwidth", type=float, default=0, help="Bytes/s per connection"
+    )
+    pargs.add_argument(
+        "-t",
+        "--total-bandwidth",
+        type=float,
+        default=0,
+        help="Bytes/s across connections",
+    )
+    pargs.add_argument(
+        "-e",
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of file requests answered with 503",
+    )
+    args = pargs.parse_args()
+
+    root = Path(args.root)
+    if not (root / PREFIX).exists():
+        make_tree(root)
+    server, url = serve(
+        root,
+        args.port,
+        total_bandwidth=args.total_bandwidth,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+    )
+    print(f"Serving {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+##############################################################################
+# Author: Owen Smith
+# Title: cache.py
+##############################################################################
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Union
+
+
+class Listing(NamedTuple):
+    status: int
+    granules: list
+    etag: str
+    last_modified: str
+    fetched: float
+
+    def validators(self) -> dict:
+        """
+        Conditional request headers for revalidating this listing
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ListingCache:
+    """
+    On-disk cache of parsed directory listings keyed by directory url.
+
+    Both successful listings and 404s (negative entries) are stored together
+    with the ETag/Last-Modified validators the server sent. Entries younger
+    than ``ttl`` seconds are served without touching the network, older ones
+    are revalidated with a conditional request.
+
+    Args:
+        path: SQLite database file
+        ttl: Seconds an entry is considered fresh
+    """
+
+    def __init__(self, path: Union[str, Path], ttl: float = 86400):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS listings ("
+            "url TEXT PRIMARY KEY, status INTEGER, granules TEXT, "
+            "etag TEXT, last_modified TEXT, fetched REAL)"
+        )
+        self._db.commit()
+
+    def get(self, url: str) -> Union[Listing, None]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, granules, etag, last_modified, fetched "
+                "FROM listings WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        status, granules, etag, last_modified, fetched = row
+        granules = granules.split("\n") if granules else []
+        return Listing(status, granules, etag, last_modified, fetched)
+
+    def fresh(self, entry: Listing, closed: bool = False) -> bool:
+        """
+        Whether an entry can be used without revalidation. Listings of
+        closed directories (past years listed after they settled) never go
+        stale.
+        """
+        return closed or time.time() - entry.fetched < self.ttl
+
+    def put(
+        self,
+        url: str,
+        status: int,
+        granules: list,
+        etag: str = None,
+        last_modified: str = None,
+    ) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?)",
+                (url, status, "\n".join(granules), etag, last_modified, time.time()),
+            )
+            self._db.commit()
+
+    def touch(self, url: str) -> None:
+        """
+        Mark an entry as freshly validated
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE listings SET fetched = ? WHERE url = ?", (time.time(), url)
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,228 @@
+##############################################################################
+# Author: Owen Smith
+# Title: clip.py
+##############################################################################
+
+import argparse
+import math
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from .hlsdownloader import Colors
+
+NODATA = -1000
+
+gdal.UseExceptions()
+
+
+def parser(argv: list) -> argparse.Namespace:
+    """
+    Command line argument parser
+    """
+    pargs = argparse.ArgumentParser(
+        prog="hlsdownloader clip",
+        description="Clip HLS v1.4 HDF files to a bounding box and write each as "
+        "a single multi-band GeoTIFF",
+    )
+    pargs.add_argument(
+        "-i", "--indir", required=True, help="Input directory of HLS v1.4 (*.hdf)"
+    )
+    pargs.add_argument(
+        "-o", "--outdir", required=True, help="Output directory for clipped GeoTIFFs"
+    )
+    pargs.add_argument(
+        "-b",
+        "--bbox",
+        nargs=4,
+        type=float,
+        required=True,
+        metavar=("ULX", "ULY", "LRX", "LRY"),
+        help="Clipping bounding box in projection of tile",
+    )
+    pargs.add_argument("-n", "--nodata", default=NODATA, type=int, help="Nodata value")
+    pargs.add_argument(
+        "-p",
+        "--processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of processes to clip files with",
+    )
+    pargs.add_argument("-v", "--verbose", action="store_true", help="Show progress")
+    return pargs.parse_args(argv)
+
+
+def projwin(geotransform: tuple, bbox: list) -> tuple:
+    """
+    Pixel window covering a bounding box, as computed by gdal_translate
+    -projwin
+
+    Args:
+        geotransform
+        bbox: ulx, uly, lrx, lry in the projection of the raster
+
+    Returns:
+        tuple: xoff, yoff, xsize, ysize
+    """
+    ulx, uly, lrx, lry = bbox
+    xoff = int(round((ulx - geotransform[0]) / geotransform[1]))
+    yoff = int(round((uly - geotransform[3]) / geotransform[5]))
+    xsize = int(math.ceil((lrx - ulx) / geotransform[1] - 1e-6))
+    ysize = int(math.ceil((lry - uly) / geotransform[5] - 1e-6))
+    if xsize <= 0 or ysize <= 0:
+        raise ValueError(f"empty bounding box {bbox}")
+    return xoff, yoff, xsize, ysize
+
+
+def read_window(band: gdal.Band, window: tuple, out: np.ndarray) -> None:
+    """
+    Read a pixel window of a band into ``out``. Parts of the window outside
+    the raster are left untouched.
+    """
+    xoff, yoff, xsize, ysize = window
+    x0, y0 = max(xoff, 0), max(yoff, 0)
+    x1, y1 = min(xoff + xsize, band.XSize), min(yoff + ysize, band.YSize)
+    if x1 <= x0 or y1 <= y0:
+        return
+    out[y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff] = band.ReadAsArray(
+        x0, y0, x1 - x0, y1 - y0
+    )
+
+
+def clip_hdf(
+    path: Union[str, Path],
+    outpath: Union[str, Path],
+    bbox: list,
+    nodata: int = NODATA,
+) -> Path:
+    """
+    Clip every subdataset of an HLS HDF file to a bounding box and write them
+    as the bands of one GeoTIFF. Only the window covering the bounding box is
+    read from each subdataset. Pixels of the box outside the tile are set to
+    ``nodata``. The GeoTIFF is written under a temporary name and renamed, so
+    ``outpath`` only ever holds a complete file.
+
+    Args:
+        path
+        outpath
+        bbox: ulx, uly, lrx, lry in the projection of the tile
+        nodata
+
+    Returns:
+        Path
+    """
+    hdf = gdal.Open(str(path))
+    subdatasets = [gdal.Open(name) for name, _ in hdf.GetSubDatasets()]
+    first = subdatasets[0]
+    geotransform = first.GetGeoTransform()
+    window = projwin(geotransform, bbox)
+    xoff, yoff, xsize, ysize = window
+
+    dtypes = [
+        gdal_array.GDALTypeCodeToNumericTypeCode(sds.GetRasterBand(1).DataType)
+        for sds in subdatasets
+    ]
+    dtype = np.result_type(*dtypes)
+    stack = np.full((len(subdatasets), ysize, xsize), nodata, dtype=dtype)
+    for i, sds in enumerate(subdatasets):
+        read_window(sds.GetRasterBand(1), window, stack[i])
+
+    tmp = Path(outpath).with_suffix(".tmp.tif")
+    out = None
+    try:
+        driver = gdal.GetDriverByName("GTiff")
+        out = driver.Create(
+            str(tmp),
+            xsize,
+            ysize,
+            len(subdatasets),
+            gdal_array.NumericTypeCodeToGDALTypeCode(dtype),
+        )
+        out.SetGeoTransform(
+            (
+                geotransform[0] + xoff * geotransform[1],
+                geotransform[1],
+                geotransform[2],
+                geotransform[3] + yoff * geotransform[5],
+                geotransform[4],
+                geotransform[5],
+            )
+        )
+        out.SetProjection(first.GetProjection())
+        for i, sds in enumerate(subdatasets):
+            band = out.GetRasterBand(i + 1)
+            band.WriteArray(stack[i])
+            band.SetNoDataValue(nodata)
+            band.SetDescription(sds.GetDescription().split(":")[-1])
+        out.FlushCache()
+        out = None
+        os.replace(tmp, outpath)
+    finally:
+        # Close the dataset before removing what is left of it
+        out = None
+        if tmp.exists():
+            tmp.unlink()
+    return Path(outpath)
+
+
+def clipped_path(path: Union[str, Path], outdir: Union[str, Path]) -> Path:
+    """
+    Output path of a clipped HDF file
+    """
+    return Path(outdir) / f"{Path(path).stem}_clipped.tif"
+
+
+def _clip(args: tuple) -> tuple:
+    path, outdir, bbox, nodata, verbose = args
+    if verbose:
+        print(f"{time.strftime('%r')}\tclipping {Path(path).name} to {bbox}")
+    try:
+        return path, clip_hdf(path, clipped_path(path, outdir), bbox, nodata), None
+    except (RuntimeError, ValueError) as e:
+        return path, None, str(e)
+
+
+def clip(
+    files: list,
+    outdir: Union[str, Path],
+    bbox: list,
+    nodata: int = NODATA,
+    processes: int = 1,
+    verbose: bool = False,
+) -> list:
+    """
+    Clip HDF files across a process pool
+
+    Args:
+        files
+        outdir
+        bbox
+        nodata
+        processes
+        verbose
+
+    Returns:
+        list: (input path, output path or None, error or None) per file
+    """
+    with mp.Pool(processes) as pool:
+        return pool.map(
+            _clip, [(path, outdir, bbox, nodata, verbose) for path in files]
+        )
+
+
+def main(argv: list = None) -> None:
+    args = parser(argv)
+    outdir = Path(args.outdir)
+    if not outdir.is_dir():
+        print("Output directory does not exist")
+        return
+    files = sorted(Path(args.indir).rglob("*.hdf"))
+    results = clip(files, outdir, args.bbox, args.nodata, args.processes, args.verbose)
+    for path, _, error in results:
+        if error is not None:
+            print(f"{Colors.error}Failed to clip: {Colors.end}{path}: {error}")
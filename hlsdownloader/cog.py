@@ -0,0 +1,255 @@
+##############################################################################
+# Author: Owen Smith
+# Title: cog.py
+##############################################################################
+
+import argparse
+import multiprocessing as mp
+import os
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Union
+
+from .hlsdownloader import Colors, granule_url
+from .manifest import DONE, FAILED, Manifest, find_manifest
+
+STAGE = "cog"
+COMPRESS = "DEFLATE"
+PREDICTOR = "STANDARD"
+BLOCKSIZE = 512
+
+
+def parser(argv: list) -> argparse.Namespace:
+    """
+    Command line argument parser
+    """
+    pargs = argparse.ArgumentParser(
+        prog="hlsdownloader cog",
+        description="Convert the subdatasets of downloaded HLS v1.4 HDF files to "
+        "tiled, compressed Cloud Optimized GeoTIFFs with overviews. Files already "
+        "converted since they were downloaded are skipped",
+    )
+    pargs.add_argument(
+        "-i",
+        "--indir",
+        required=True,
+        help="Output directory of hlsdownloader holding the S30 and L30 folders",
+    )
+    pargs.add_argument(
+        "-o", "--outdir", help="Directory for the COGs (default: INDIR/COG)"
+    )
+    pargs.add_argument(
+        "-m",
+        "--manifest",
+        help="Download manifest (default: INDIR/manifest.db, or the only "
+        "manifest.<node>.db there)",
+    )
+    add_options(pargs)
+    pargs.add_argument(
+        "-p",
+        "--processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of processes to convert files with",
+    )
+    return pargs.parse_args(argv)
+
+
+def add_options(pargs: argparse.ArgumentParser, prefix: str = "") -> None:
+    """
+    Add the COG creation options to a parser, optionally prefixed
+    """
+    pargs.add_argument(
+        f"--{prefix}compress",
+        default=COMPRESS,
+        choices=["DEFLATE", "LZW", "ZSTD", "LZMA", "NONE"],
+        help="Compression of the COGs",
+    )
+    pargs.add_argument(
+        f"--{prefix}predictor",
+        default=PREDICTOR,
+        choices=["NO", "STANDARD", "FLOATING_POINT"],
+        help="Predictor used with DEFLATE, LZW and ZSTD compression",
+    )
+    pargs.add_argument(
+        f"--{prefix}blocksize",
+        default=BLOCKSIZE,
+        type=int,
+        help="Tile size in pixels of the COGs",
+    )
+
+
+def convert_hdf(
+    path: Union[str, Path],
+    outdir: Union[str, Path],
+    compress: str = COMPRESS,
+    predictor: str = PREDICTOR,
+    blocksize: int = BLOCKSIZE,
+) -> list:
+    """
+    Write every subdataset of an HDF file as a COG in ``outdir/<granule>/``
+
+    Overviews of the QA band are built with nearest neighbour resampling so
+    bit flags survive, reflectance bands are averaged. Each COG is written
+    to a temporary name and renamed once complete.
+
+    Args:
+        path
+        outdir
+        compress
+        predictor
+        blocksize
+
+    Returns:
+        list: Paths of the COGs
+    """
+    from osgeo import gdal
+
+    gdal.UseExceptions()
+    granule_dir = Path(outdir) / Path(path).stem
+    granule_dir.mkdir(parents=True, exist_ok=True)
+    outputs = []
+    for name, _ in gdal.Open(str(path)).GetSubDatasets():
+        band = name.split(":")[-1]
+        outpath = granule_dir / f"{band}.tif"
+        # Unique per conversion, so nodes converting the same file on a shared
+        # tree never write to the same temporary file
+        tmp = granule_dir / f"{band}.{uuid.uuid4().hex}.tmp.tif"
+        resampling = "NEAREST" if "QA" in band.upper() else "AVERAGE"
+        try:
+            gdal.Translate(
+                str(tmp),
+                name,
+                format="COG",
+                creationOptions=[
+                    f"COMPRESS={compress}",
+                    f"PREDICTOR={predictor}",
+                    f"BLOCKSIZE={blocksize}",
+                    f"RESAMPLING={resampling}",
+                    "OVERVIEWS=AUTO",
+                    "BIGTIFF=IF_SAFER",
+                ],
+            )
+            os.replace(tmp, outpath)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        outputs.append(outpath)
+    return outputs
+
+
+class Converter:
+    """
+    Converts downloaded HDF files to COGs on a process pool and records each
+    conversion in the manifest. Downloading a file again clears its record,
+    so only new or changed files are converted.
+
+    Args:
+        manifest
+        outdir: Root directory of the COGs, one folder per sensor
+        processes
+        compress
+        predictor
+        blocksize
+    """
+
+    def __init__(
+        self,
+        manifest: Manifest,
+        outdir: Union[str, Path],
+        processes: int = 1,
+        compress: str = COMPRESS,
+        predictor: str = PREDICTOR,
+        blocksize: int = BLOCKSIZE,
+    ):
+        self.manifest = manifest
+        self.outdir = Path(outdir)
+        self.options = (compress, predictor, blocksize)
+        # Forking while download threads hold locks (and sockets) can leave
+        # workers deadlocked, start them fresh instead
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=mp.get_context("spawn")
+        )
+        self._futures = []
+        self._submitted = set()
+
+    def submit(self, url: str, path: Union[str, Path]) -> Future:
+        """
+        Queue a downloaded HDF file for conversion
+        """
+        self._submitted.add(url)
+        sensor = Path(path).name.split(".")[1]
+        future = self._executor.submit(
+            convert_hdf, path, self.outdir / sensor, *self.options
+        )
+        future.add_done_callback(lambda f: self._record(url, path, f))
+        self._futures.append(future)
+        return future
+
+    def _record(self, url: str, path: Union[str, Path], future: Future) -> None:
+        error = future.exception()
+        if error is None:
+            self.manifest.record_stage(url, STAGE, DONE)
+            print(f"{Colors.ok}Converted: {Colors.end}{Path(path).name}")
+        else:
+            self.manifest.record_stage(url, STAGE, FAILED, repr(error))
+            print(f"{Colors.error}Failed to convert: {Colors.end}{Path(path).name}")
+
+    def submit_pending(
+        self, indir: Union[str, Path], recorded_only: bool = False
+    ) -> int:
+        """
+        Queue every HDF file under the S30 and L30 folders of ``indir`` that
+        is not converted or queued yet. With ``recorded_only``, only files the
+        manifest records as downloaded are queued, leaving the files other
+        nodes downloaded to the same tree to them.
+
+        Returns:
+            int: Number of files queued
+        """
+        indir = Path(indir)
+        converted = self.manifest.stage_urls(STAGE)
+        count = 0
+        for path in sorted(indir.glob("S30/*.hdf")) + sorted(indir.glob("L30/*.hdf")):
+            url = granule_url(path.name)
+            if url in converted or url in self._submitted:
+                continue
+            if recorded_only and not self.manifest.is_done(url):
+                continue
+            if not self.manifest.is_done(url):
+                # Downloaded before the manifest was kept
+                self.manifest.finish(url, path.stat().st_size)
+            self.submit(url, path)
+            count += 1
+        return count
+
+    def close(self) -> None:
+        """
+        Wait for all queued conversions to finish
+        """
+        for future in self._futures:
+            future.exception()
+        self._executor.shutdown()
+
+
+def main(argv: list = None) -> None:
+    args = parser(argv)
+    indir = Path(args.indir)
+    try:
+        manifest = Manifest(args.manifest or find_manifest(indir))
+    except ValueError as e:
+        print(f"{Colors.error}{e}{Colors.end}")
+        return
+    converter = Converter(
+        manifest,
+        args.outdir or indir / "COG",
+        args.processes,
+        args.compress,
+        args.predictor,
+        args.blocksize,
+    )
+    count = converter.submit_pending(indir)
+    converter.close()
+    manifest.close()
+    print(f"Processed {count} files")
@@ -0,0 +1,138 @@
+##############################################################################
+# Author: Owen Smith
+# Title: connection.py
+##############################################################################
+
+import http.client
+import threading
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of keep-alive HTTP(S) connections.
+
+    Idle connections are kept per host and handed back out to the next
+    request for the same host, so repeated requests to the HLS server skip
+    the TCP/TLS handshake. At most ``maxsize`` requests are in flight to a
+    single host at any time.
+
+    Args:
+        maxsize: Maximum number of concurrent connections per host
+        timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, maxsize: int = 8, timeout: float = 60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, key: tuple) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.maxsize)
+            return self._slots[key]
+
+    def _connect(self, key: tuple) -> http.client.HTTPConnection:
+        scheme, netloc = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _get(self, key: tuple) -> tuple:
+        """
+        Returns an idle connection for ``key`` if one exists, otherwise a new
+        one. The second element flags whether the connection was reused.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _put(self, key: tuple, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def _send(self, key: tuple, method: str, target: str, headers: dict) -> tuple:
+        conn, reused = self._get(key)
+        try:
+            conn.request(method, target, headers=headers)
+            return conn, conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+        # The server dropped an idle keep-alive connection, retry on a new one
+        conn = self._connect(key)
+        try:
+            conn.request(method, target, headers=headers)
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    @contextmanager
+    def request(self, url: str, method: str = "GET", headers: dict = None):
+        """
+        Issue a request, following redirects, and yield the response.
+
+        The connection is returned to the pool once the body has been read to
+        completion, otherwise it is closed.
+
+        Args:
+            url
+            method
+            headers
+
+        Yields:
+            http.client.HTTPResponse
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+
+            slot = self._slot(key)
+            slot.acquire()
+            try:
+                conn, resp = self._send(key, method, target, headers)
+                location = resp.getheader("Location")
+                if resp.status in REDIRECTS and location:
+                    resp.read()
+                    self._release(key, conn, resp)
+                    url = urljoin(url, location)
+                    continue
+                try:
+                    yield resp
+                finally:
+                    self._release(key, conn, resp)
+                return
+            finally:
+                slot.release()
+        raise http.client.HTTPException(f"Too many redirects: {url}")
+
+    def _release(self, key, conn, resp) -> None:
+        if resp.isclosed() and not resp.will_close:
+            self._put(key, conn)
+        else:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
@@ -0,0 +1,138 @@
+##############################################################################
+# Author: Owen Smith
+# Title: controller.py
+##############################################################################
+
+import threading
+import time
+from typing import Callable
+from urllib.error import HTTPError
+
+INTERVAL = 5.0
+
+
+def congested(error: Exception) -> bool:
+    """
+    Whether an error signals that the server or network is overloaded:
+    timeouts, dropped connections, 429 and 5xx responses
+    """
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class AIMDController:
+    """
+    Additive-increase/multiplicative-decrease limit on concurrent downloads.
+
+    Aggregate throughput is measured over windows of ``interval`` seconds.
+    While a window beats the previous one by more than ``tolerance`` the limit
+    grows by one. A congestion error (see ``congested``) multiplies the limit
+    by ``decrease``, at most once per window. Every change is passed to
+    ``log``.
+
+    Use as a context manager around each download to hold one of the
+    ``limit`` slots.
+
+    Args:
+        maximum: Upper bound on the limit
+        initial: Starting limit
+        minimum: Lower bound on the limit
+        interval: Seconds per throughput window
+        decrease: Factor applied to the limit on congestion
+        tolerance: Relative throughput gain needed to grow the limit
+        log: Called with (limit, bytes per second, reason) on every change
+        fixed: Keep the limit at ``maximum``
+    """
+
+    def __init__(
+        self,
+        maximum: int,
+        initial: int = 2,
+        minimum: int = 1,
+        interval: float = INTERVAL,
+        decrease: float = 0.5,
+        tolerance: float = 0.05,
+        log: Callable = None,
+        fixed: bool = False,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum if fixed else max(minimum, min(initial, maximum))
+        self.interval = interval
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.fixed = fixed
+        self._log = log
+        self._active = 0
+        self._cond = threading.Condition()
+        self._bytes = 0
+        self._window = time.monotonic()
+        self._rate = 0.0
+        self._backoff = 0.0
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            self._adjust()
+            self._cond.notify_all()
+
+    def record(self, nbytes: int) -> None:
+        """
+        Count transferred bytes towards the current throughput window
+        """
+        with self._cond:
+            self._bytes += nbytes
+            self._adjust()
+
+    def congestion(self, error: Exception) -> None:
+        """
+        Report a failed transfer attempt
+        """
+        if self.fixed or not congested(error):
+            return
+        with self._cond:
+            now = time.monotonic()
+            if now - self._backoff < self.interval:
+                return
+            self._backoff = now
+            self._set(
+                max(self.minimum, int(self.limit * self.decrease)),
+                self._rate,
+                f"backoff after {error!r}",
+            )
+            # Measure the new limit from a clean window
+            self._bytes = 0
+            self._window = now
+            self._rate = 0.0
+
+    def _adjust(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._window
+        if elapsed < self.interval:
+            return
+        rate = self._bytes / elapsed
+        if (
+            not self.fixed
+            and self.limit < self.maximum
+            and self._active >= self.limit
+            and rate > self._rate * (1 + self.tolerance)
+        ):
+            self._set(self.limit + 1, rate, "throughput improved")
+        self._rate = rate
+        self._bytes = 0
+        self._window = now
+
+    def _set(self, limit: int, rate: float, reason: str) -> None:
+        if limit != self.limit:
+            self.limit = limit
+            if self._log is not None:
+                self._log(limit, rate, reason)
+        self._cond.notify_all()
@@ -0,0 +1,306 @@
+##############################################################################
+# Author: Owen Smith
+# Title: cube.py
+##############################################################################
+
+import argparse
+import multiprocessing as mp
+from itertools import groupby
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import zarr
+from osgeo import gdal, gdal_array
+
+from .hlsdownloader import Colors, granule_url
+from .manifest import DONE, FAILED, Manifest, find_manifest
+
+STAGE = "cube"
+TIME_CHUNK = 64
+SPACE_CHUNK = 128
+
+gdal.UseExceptions()
+
+
+def parser(argv: list) -> argparse.Namespace:
+    """
+    Command line argument parser
+    """
+    pargs = argparse.ArgumentParser(
+        prog="hlsdownloader cube",
+        description="Append downloaded HLS v1.4 HDF files to one Zarr time "
+        "series cube per tile, chunked so reading the full time series of a "
+        "pixel touches a few chunks per band. Files already in a cube since "
+        "they were downloaded are skipped",
+    )
+    pargs.add_argument(
+        "-i",
+        "--indir",
+        required=True,
+        help="Output directory of hlsdownloader holding the S30 and L30 folders",
+    )
+    pargs.add_argument(
+        "-o", "--outdir", help="Directory for the cubes (default: INDIR/cube)"
+    )
+    pargs.add_argument(
+        "-m",
+        "--manifest",
+        help="Download manifest (default: INDIR/manifest.db, or the only "
+        "manifest.<node>.db there)",
+    )
+    pargs.add_argument(
+        "-t", "--tiles", nargs="+", help="Only build these tiles, e.g. 17SPA"
+    )
+    pargs.add_argument(
+        "--time-chunk",
+        default=TIME_CHUNK,
+        type=int,
+        help="Number of dates in each chunk",
+    )
+    pargs.add_argument(
+        "--space-chunk",
+        default=SPACE_CHUNK,
+        type=int,
+        help="Rows and columns in each chunk",
+    )
+    pargs.add_argument(
+        "-p",
+        "--processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of tiles to build at once",
+    )
+    return pargs.parse_args(argv)
+
+
+def granule_sensor(path: Path) -> str:
+    return path.name.split(".")[1]
+
+
+def granule_tile(path: Path) -> str:
+    return path.name.split(".")[2]
+
+
+def granule_date(name: str) -> np.datetime64:
+    """
+    Acquisition date of a granule from the YYYYDOY field of its name
+    """
+    doy = name.split(".")[3]
+    return np.datetime64(f"{doy[:4]}-01-01") + np.timedelta64(int(doy[4:]) - 1, "D")
+
+
+def write_batch(
+    group: zarr.Group,
+    paths: list,
+    start: int,
+    time_chunk: int,
+    space_chunk: int,
+) -> None:
+    """
+    Write granules of one sensor to the arrays of its group from time index
+    ``start`` on, growing the arrays as needed
+
+    Each band is copied in strips of ``space_chunk`` rows read from every
+    granule at once. When ``paths`` fill whole time chunks, every chunk is
+    written exactly once.
+
+    Args:
+        group
+        paths
+        start
+        time_chunk
+        space_chunk
+    """
+    end = start + len(paths)
+    names = [[name for name, _ in gdal.Open(str(p)).GetSubDatasets()] for p in paths]
+    bands = [name.split(":")[-1] for name in names[0]]
+    for path, subdatasets in zip(paths, names):
+        if [name.split(":")[-1] for name in subdatasets] != bands:
+            raise ValueError(f"{path.name} does not have the bands {bands}")
+
+    for b, band in enumerate(bands):
+        rasters = [gdal.Open(subdatasets[b]) for subdatasets in names]
+        first = rasters[0].GetRasterBand(1)
+        xsize, ysize = first.XSize, first.YSize
+        if band in group:
+            array = group[band]
+        else:
+            array = group.create_dataset(
+                band,
+                shape=(0, ysize, xsize),
+                chunks=(time_chunk, space_chunk, space_chunk),
+                dtype=gdal_array.GDALTypeCodeToNumericTypeCode(first.DataType),
+                fill_value=first.GetNoDataValue(),
+            )
+        if array.shape[1:] != (ysize, xsize):
+            raise ValueError(f"{band} is {ysize}x{xsize}, the cube {array.shape}")
+        if array.shape[0] < end:
+            array.resize(end, ysize, xsize)
+        for y in range(0, ysize, space_chunk):
+            rows = min(space_chunk, ysize - y)
+            array[start:end, y : y + rows] = np.stack(
+                [r.GetRasterBand(1).ReadAsArray(0, y, xsize, rows) for r in rasters]
+            )
+        rasters = None
+
+    if "time" in group:
+        times = group["time"]
+    else:
+        times = group.create_dataset("time", shape=(0,), chunks=(4096,), dtype="M8[D]")
+    if times.shape[0] < end:
+        times.resize(end)
+    times[start:end] = [granule_date(p.name) for p in paths]
+
+
+def append_granules(
+    path: Union[str, Path],
+    files: list,
+    time_chunk: int = TIME_CHUNK,
+    space_chunk: int = SPACE_CHUNK,
+) -> list:
+    """
+    Add HDF files of one tile to its cube
+
+    The cube holds a group per sensor with an array per band shaped (time,
+    row, column), a ``time`` array of acquisition dates and the names of the
+    granules in its ``granules`` attribute. New granules are appended in
+    date order; one downloaded again replaces its earlier copy in place.
+    Granules arriving after later dates are already in the cube are appended
+    at the end, so the time axis is not necessarily sorted, see drill.
+
+    The ``granules`` attribute is only updated once a batch is fully
+    written, so an interrupted run is repaired by running again.
+
+    Args:
+        path: Zarr store of the tile
+        files: HDF files of the tile
+        time_chunk
+        space_chunk
+
+    Returns:
+        list: Files added or replaced
+    """
+    root = zarr.open_group(str(path), mode="a")
+    done = []
+    files = sorted(files, key=granule_sensor)
+    for name, sensor_files in groupby(files, key=granule_sensor):
+        group = root.require_group(name)
+        granules = list(group.attrs.get("granules", []))
+        index = {granule: i for i, granule in enumerate(granules)}
+        # Names of one sensor and tile only differ in the date
+        sensor_files = sorted(sensor_files)
+
+        for p in sensor_files:
+            if p.name in index:
+                write_batch(group, [p], index[p.name], time_chunk, space_chunk)
+                done.append(p)
+
+        new = [p for p in sensor_files if p.name not in index]
+        while new:
+            # Fill up the last, partial time chunk first
+            batch = new[: time_chunk - len(granules) % time_chunk]
+            new = new[len(batch) :]
+            write_batch(group, batch, len(granules), time_chunk, space_chunk)
+            granules.extend(p.name for p in batch)
+            group.attrs["granules"] = granules
+            done.extend(batch)
+    return done
+
+
+def drill(path: Union[str, Path], sensor: str, band: str, row: int, col: int):
+    """
+    Time series of one pixel of a cube, sorted by date
+
+    Args:
+        path: Zarr store of the tile
+        sensor: S30 or L30
+        band
+        row
+        col
+
+    Returns:
+        tuple: Dates and values
+    """
+    group = zarr.open_group(str(path), mode="r")[sensor]
+    count = len(group.attrs["granules"])
+    times = group["time"][:count]
+    values = group[band][:count, row, col]
+    order = np.argsort(times, kind="stable")
+    return times[order], values[order]
+
+
+def _build(args: tuple) -> tuple:
+    path, files, time_chunk, space_chunk = args
+    try:
+        return path, append_granules(path, files, time_chunk, space_chunk), None
+    except (RuntimeError, ValueError) as e:
+        return path, [], str(e)
+
+
+def build(
+    files: list,
+    outdir: Union[str, Path],
+    time_chunk: int = TIME_CHUNK,
+    space_chunk: int = SPACE_CHUNK,
+    processes: int = 1,
+) -> list:
+    """
+    Add HDF files to the cubes of their tiles, one tile per process
+
+    Args:
+        files
+        outdir
+        time_chunk
+        space_chunk
+        processes
+
+    Returns:
+        list: (cube path, files added, error or None) per tile
+    """
+    files = sorted(files, key=granule_tile)
+    tasks = [
+        (Path(outdir) / f"{name}.zarr", list(tile_files), time_chunk, space_chunk)
+        for name, tile_files in groupby(files, key=granule_tile)
+    ]
+    with mp.Pool(processes) as pool:
+        return pool.map(_build, tasks)
+
+
+def main(argv: list = None) -> None:
+    args = parser(argv)
+    indir = Path(args.indir)
+    outdir = Path(args.outdir or indir / "cube")
+    outdir.mkdir(parents=True, exist_ok=True)
+    try:
+        manifest = Manifest(args.manifest or find_manifest(indir))
+    except ValueError as e:
+        print(f"{Colors.error}{e}{Colors.end}")
+        return
+
+    added = manifest.stage_urls(STAGE)
+    tiles = {f"T{tile}" for tile in args.tiles} if args.tiles else None
+    files = []
+    for path in sorted(indir.glob("S30/*.hdf")) + sorted(indir.glob("L30/*.hdf")):
+        url = granule_url(path.name)
+        if url in added or (tiles and granule_tile(path) not in tiles):
+            continue
+        if not manifest.is_done(url):
+            # Downloaded before the manifest was kept
+            manifest.finish(url, path.stat().st_size)
+        files.append(path)
+
+    count = 0
+    for path, done, error in build(
+        files, outdir, args.time_chunk, args.space_chunk, args.processes
+    ):
+        for file in done:
+            manifest.record_stage(granule_url(file.name), STAGE, DONE)
+        count += len(done)
+        if error is not None:
+            print(f"{Colors.error}Failed to build: {Colors.end}{path}: {error}")
+            for file in files:
+                if granule_tile(file) == path.stem and file not in done:
+                    manifest.record_stage(granule_url(file.name), STAGE, FAILED, error)
+    manifest.close()
+    print(f"Added {count} files to cubes in {outdir}")
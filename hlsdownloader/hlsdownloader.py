@@ -5,21 +5,47 @@
 ##############################################################################
 
 import argparse
-from typing import Union
+import importlib
+import sys
+from typing import Callable, Union
 from pathlib import Path
-from urllib.request import urlopen, urlretrieve
-import re
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
+import queue
+import re
+import socket
+import threading
 import time
 
+from .cache import ListingCache
+from .connection import ConnectionPool
+from .controller import AIMDController
+from .manifest import FAILED, RUNNING, Manifest
+from .shard import WorkQueue, parse_shard, shard_urls, steal_order
+from .store import BUDGET, GranuleStore, parse_size
+from .transfer import BUFFER_SIZE, RETRIES, SEGMENT_SIZE, fetch, remote_size
+
 ##############
 # Constants
 URL = "https://hls.gsfc.nasa.gov/data/v1.4"
 SENSORS = ["S30", "L30"]
+# Days after the end of a year until listings of its directories are final
+CLOSE_LAG = 90
+# Seconds between checks for cancellation while waiting on the file queue
+POLL_INTERVAL = 0.5
+COMMANDS = {
+    "validate": "Check downloaded HDF files and report or requeue broken ones",
+    "clip": "Clip HDF files to a bounding box as multi-band GeoTIFFs",
+    "cog": "Convert HDF files to Cloud Optimized GeoTIFFs",
+    "cube": "Append HDF files to per-tile Zarr time series cubes",
+    "qa": "Decode QA bands into masks and per-tile clear observation counts",
+}
 
 #############
 # Misc
 regex = re.compile(r'\"HLS(.*?)\.hdf"')
+year_regex = re.compile(r"/(?:S30|L30)/(\d{4})/")
 
 
 class Colors:
@@ -36,9 +62,13 @@ def parser() -> argparse.Namespace:
     """
     Command line argument parser
     """
+    from . import cog
+
     pargs = argparse.ArgumentParser(
         description="CLI tool for downloading v1.4 Harmonized Landsat Sentinel products. "
-        "Offers multiprocessing support"
+        "Offers multiprocessing support",
+        epilog="other commands (run 'hlsdownloader COMMAND -h' for help): "
+        + "; ".join(f"{name}: {help}" for name, help in COMMANDS.items()),
     )
     pargs.add_argument(
         "-o",
@@ -54,14 +84,150 @@ def parser() -> argparse.Namespace:
         help="Years to download",
     )
     pargs.add_argument(
-        "-l", "--log", default="./failed.txt", help="File listing failed downloads"
+        "-m",
+        "--manifest",
+        help="SQLite file recording the state of every download "
+        "(default: OUTDIR/manifest.db)",
+    )
+    pargs.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only download files recorded as failed in the manifest, or left "
+        "running by an interrupted run",
     )
     pargs.add_argument(
         "-p",
         "--processes",
-        default=mp.cpu_count() // 2,
+        "--workers",
+        dest="workers",
+        default=16,
+        type=int,
+        help="Maximum number of concurrent downloads",
+    )
+    pargs.add_argument(
+        "--initial-workers",
+        default=2,
+        type=int,
+        help="Number of concurrent downloads to start with. More are added while "
+        "throughput improves and they are cut back on timeouts, 429 or 5xx errors",
+    )
+    pargs.add_argument(
+        "--fixed-workers",
+        action="store_true",
+        help="Always run --workers concurrent downloads",
+    )
+    pargs.add_argument(
+        "--per-host",
+        type=int,
+        help="Maximum number of connections to a single host (default: --workers)",
+    )
+    pargs.add_argument(
+        "--buffer-size",
+        default=BUFFER_SIZE,
+        type=int,
+        help="Size in bytes of the chunks streamed to disk",
+    )
+    pargs.add_argument(
+        "--retries",
+        default=RETRIES,
+        type=int,
+        help="Number of times an interrupted download is resumed",
+    )
+    pargs.add_argument(
+        "--segments",
+        default=1,
+        type=int,
+        help="Number of byte ranges of a single file to fetch concurrently",
+    )
+    pargs.add_argument(
+        "--segment-size",
+        default=SEGMENT_SIZE,
+        type=int,
+        help="Size in bytes of each range when --segments is above one",
+    )
+    pargs.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only download shard K of N (given as K/N) of the sensor/tile/year "
+        "directories, for splitting a run across nodes",
+    )
+    pargs.add_argument(
+        "--work-queue",
+        help="Directory shared by all nodes where directories are claimed before "
+        "download. Nodes work through their own --shard first, then pick up "
+        "unclaimed directories of other shards. Use a new directory per run",
+    )
+    pargs.add_argument(
+        "--clip-bbox",
+        nargs=4,
+        type=float,
+        metavar=("ULX", "ULY", "LRX", "LRY"),
+        help="Clip every granule to this bounding box (in projection of the tile) "
+        "as soon as it is downloaded and only keep the clipped GeoTIFF. Requires "
+        "numpy and GDAL",
+    )
+    pargs.add_argument(
+        "--clip-nodata",
+        default=-1000,
+        type=int,
+        help="Nodata value of clipped GeoTIFFs",
+    )
+    pargs.add_argument(
+        "--scratch",
+        help="Directory granules are downloaded to before clipping "
+        "(default: OUTDIR/scratch)",
+    )
+    pargs.add_argument(
+        "--cog",
+        action="store_true",
+        help="Convert every downloaded HDF file to Cloud Optimized GeoTIFFs, one "
+        "per subdataset. Requires GDAL",
+    )
+    pargs.add_argument(
+        "--cog-dir", help="Directory for the COGs (default: OUTDIR/COG)"
+    )
+    pargs.add_argument(
+        "--cog-processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of processes to convert files with",
+    )
+    cog.add_options(pargs, prefix="cog-")
+    pargs.add_argument(
+        "--store",
+        help="Download cache shared between output directories. Files it holds "
+        "are linked into OUTDIR instead of downloaded again",
+    )
+    pargs.add_argument(
+        "--store-budget",
+        default=BUDGET,
+        type=parse_size,
+        help="Size the shared store is kept under by evicting the least "
+        "recently used files, e.g. 500G (default: %(default)s)",
+    )
+    pargs.add_argument(
+        "--list-concurrency",
+        default=8,
         type=int,
-        help="Number of threads to split download between",
+        help="Number of directory listings to fetch concurrently",
+    )
+    pargs.add_argument(
+        "--listing-cache",
+        help="SQLite file caching directory listings between runs "
+        "(default: OUTDIR/listings.db)",
+    )
+    pargs.add_argument(
+        "--listing-ttl",
+        default=86400,
+        type=float,
+        help="Seconds before a cached listing is revalidated, unless it was "
+        f"fetched {CLOSE_LAG} days or more after the end of its year",
+    )
+    pargs.add_argument(
+        "--queue-depth",
+        default=1000,
+        type=int,
+        help="Maximum number of listed files waiting to be downloaded",
     )
     return pargs.parse_args()
 
@@ -88,61 +254,413 @@ def construct_dir_urls(sensors: list, tiles: list, years: list) -> list:
     return tile_urls
 
 
-def construct_file_urls(dir_urls: list) -> list:
+def granule_url(file_name: str) -> str:
+    """
+    Reconstruct the url of a granule file from its name
+
+    Args:
+        file_name
+
+    Returns:
+        str
+    """
+    _, sensor, tile, date = file_name.split(".")[:4]
+    return (
+        f"{URL}/{sensor}/{date[0:4]}/{tile[1:3]}/{tile[3]}/{tile[4]}/{tile[5]}/"
+        f"{file_name}"
+    )
+
+
+def closed_directory(url: str, fetched: float) -> bool:
+    """
+    Whether a listing of a directory fetched at ``fetched`` is final. Late
+    and reprocessed granules keep appearing after a year ends, so only
+    listings fetched ``CLOSE_LAG`` days or more after the end of the year of
+    the directory are.
+
+    Args:
+        url
+        fetched: Seconds since the epoch
+
+    Returns:
+        bool
+    """
+    match = year_regex.search(url)
+    if match is None:
+        return False
+    year_end = time.mktime((int(match.group(1)) + 1, 1, 1, 0, 0, 0, 0, 0, -1))
+    return fetched >= year_end + CLOSE_LAG * 86400
+
+
+def list_directory(url: str, pool: ConnectionPool, cache: ListingCache = None) -> list:
+    """
+    List the base names of all HDF granules in a directory. Directories that
+    do not exist on the server are treated as empty.
+
+    Args:
+        url
+        pool
+        cache
+
+    Returns:
+        list
+    """
+    headers = {}
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None:
+        if cache.fresh(entry, closed_directory(url, entry.fetched)):
+            return entry.granules
+        headers = entry.validators()
+
+    with pool.request(url, headers=headers) as req:
+        body = req.read()
+        if req.status == 304 and entry is not None:
+            cache.touch(url)
+            return entry.granules
+        if req.status == 404:
+            if cache is not None:
+                cache.put(url, 404, [])
+            return []
+        if req.status != 200:
+            raise HTTPError(url, req.status, req.reason, req.headers, None)
+        encoding = req.headers.get_content_charset() or "utf-8"
+        etag = req.getheader("ETag")
+        last_modified = req.getheader("Last-Modified")
+
+    # xml.etree.ElementTree is not able to parse the requests correctly.
+    # Resort to regex pattern matching to get all base file names
+    # and reconstruct.
+    file_list = regex.findall(body.decode(encoding))
+    if cache is not None:
+        cache.put(url, 200, file_list, etag, last_modified)
+    return file_list
+
+
+def granule_urls(url: str, file_list: list, headers: bool = True) -> list:
+    """
+    Construct the hdf and header urls for granules of a directory
+
+    Args:
+        url
+        file_list
+        headers: Include the .hdf.hdr files
+
+    Returns:
+        list
+    """
+    file_paths = [f"{url}/HLS{i}.hdf" for i in file_list]
+    if headers:
+        file_paths.extend([f"{url}/HLS{i}.hdf.hdr" for i in file_list])
+    return file_paths
+
+
+def construct_file_urls(
+    dir_urls: list, concurrency: int = 8, cache: ListingCache = None
+) -> list:
     """
     Construct urls for individual files
 
+    Directory listings are fetched concurrently over a shared pool of
+    keep-alive connections. Results keep the order of ``dir_urls``.
+
     Args:
         dir_urls
+        concurrency
+        cache
 
     Returns:
         List
     """
+    pool = ConnectionPool(maxsize=concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            listings = list(
+                executor.map(lambda url: list_directory(url, pool, cache), dir_urls)
+            )
+    finally:
+        pool.close()
+
     file_paths = []
-    for url in dir_urls:
-        req = urlopen(url)
-        encoding = req.headers.get_content_charset()
-        req_str = req.read().decode(encoding)
+    for url, file_list in zip(dir_urls, listings):
+        file_paths.extend(granule_urls(url, file_list))
 
-        # xml.etree.ElementTree is not able to parse the requests correctly.
-        # Resort to regex pattern matching to get all base file names
-        # and reconstruct.
-        file_list = regex.findall(req_str)
+    return file_paths
 
-        file_paths.extend([f"{url}/HLS{i}.hdf" for i in file_list])
-        file_paths.extend([f"{url}/HLS{i}.hdf.hdr" for i in file_list])
 
-    return file_paths
+def put_file_url(
+    file_queue: queue.Queue, path: Union[str, None], cancel: threading.Event = None
+) -> bool:
+    """
+    Put a file url on the download queue, waiting while it is full until
+    ``cancel`` is set
+
+    Args:
+        file_queue
+        path
+        cancel
+
+    Returns:
+        bool: Whether the url was put on the queue
+    """
+    if cancel is None:
+        file_queue.put(path)
+        return True
+    while not cancel.is_set():
+        try:
+            file_queue.put(path, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def produce_file_urls(
+    dir_urls: list,
+    file_queue: queue.Queue,
+    concurrency: int = 8,
+    cache: ListingCache = None,
+    claim: Callable = None,
+    release: Callable = None,
+    headers: bool = True,
+    cancel: threading.Event = None,
+) -> None:
+    """
+    Producer half of the download pipeline. Lists directories concurrently
+    and puts the file urls of each directory on ``file_queue`` as soon as its
+    listing returns. Listing workers block while the queue is full. A single
+    None is put on the queue once every directory has been listed.
 
+    Once ``cancel`` is set, no more directories are listed and nothing more
+    is put on the queue, so listing workers blocked on a full queue return.
 
-def downloader(path: str, outdir: Union[str, Path], logfile: str) -> None:
+    Args:
+        dir_urls
+        file_queue
+        concurrency
+        cache
+        claim: Called with each directory url before it is listed, the
+            directory is skipped if it returns False
+        release: Called with a claimed directory url whose urls could not
+            all be queued, because listing it failed or ``cancel`` was set
+        headers: Queue the .hdf.hdr files as well
+        cancel: Set when the downloads stopped
     """
-    Helper function to download individual files
+
+    def feed(url):
+        if cancel is not None and cancel.is_set():
+            return
+        if claim is not None and not claim(url):
+            return
+        try:
+            file_list = list_directory(url, pool, cache)
+        except Exception:
+            if release is not None:
+                release(url)
+            raise
+        for path in granule_urls(url, file_list, headers):
+            if not put_file_url(file_queue, path, cancel):
+                if release is not None:
+                    release(url)
+                return
+
+    pool = ConnectionPool(maxsize=concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(feed, url) for url in dir_urls]
+            for future in futures:
+                future.result()
+    finally:
+        pool.close()
+        put_file_url(file_queue, None, cancel)
+
+
+def downloader(
+    path: str,
+    outdir: Union[str, Path],
+    manifest: Manifest,
+    pool: ConnectionPool,
+    controller: AIMDController,
+    buffer_size: int = BUFFER_SIZE,
+    retries: int = RETRIES,
+    segments: int = 1,
+    segment_size: int = SEGMENT_SIZE,
+    clip_bbox: list = None,
+    clip_nodata: int = -1000,
+    scratch: Union[str, Path] = None,
+    on_complete: Callable = None,
+    store: GranuleStore = None,
+) -> None:
+    """
+    Helper function to download individual files. Files are only moved to
+    their final path once complete, so an existing file is never truncated.
+    The outcome of every download is recorded in the manifest.
+
+    With ``clip_bbox`` the file is downloaded into ``scratch``, clipped to
+    the bounding box as soon as it is complete and removed again, so only
+    the clipped GeoTIFF is kept.
+
+    With a ``store``, HDF files it already holds with the size the server
+    reports are linked from it instead of downloaded, and downloaded ones
+    are added to it.
 
     Args:
         path
         outdir
-        logfile
+        manifest
+        pool
+        controller
+        buffer_size
+        retries
+        segments
+        segment_size
+        clip_bbox: ulx, uly, lrx, lry in the projection of the tile
+        clip_nodata
+        scratch
+        on_complete: Called with the url and output path of every completed
+            download
+        store
     """
     file_name = path.split("/")[-1]
     outpath = outdir / file_name[4:7] / file_name
-    print(outpath)
+    download_path = outpath
+    if clip_bbox is not None:
+        from . import clip
+
+        outpath = clip.clipped_path(file_name, outdir / file_name[4:7])
+        download_path = Path(scratch) / file_name
+    if manifest.is_done(path):
+        print(f"{Colors.warning}Skiping {file_name}. Already exists. {Colors.end}")
+        return
     if outpath.exists():
+        # Downloaded before the manifest was kept
+        manifest.finish(path, outpath.stat().st_size)
         print(f"{Colors.warning}Skiping {file_name}. Already exists. {Colors.end}")
         return
-    print(f"{Colors.cyan}Downloading: {Colors.end}{file_name}")
+    manifest.start(path)
     try:
         start = time.time()
-        urlretrieve(path, str(outpath))
-        print(f"{Colors.ok}Complete: {Colors.end}{time.time() - start:.2f}s", file_name)
-    except:
-        # if error add the failed file to a log file for download later
+        # Headers are small enough to always fetch
+        shared = store is not None and file_name.endswith(".hdf")
+        size = None
+        if shared and not download_path.exists():
+            expected = remote_size(pool, path)
+            if expected is not None and store.get(file_name, expected, download_path):
+                print(f"{Colors.cyan}Linked from store: {Colors.end}{file_name}")
+                size = expected
+        if size is None:
+            with controller:
+                print(f"{Colors.cyan}Downloading: {Colors.end}{file_name}")
+                if download_path.exists():
+                    # Downloaded to scratch by a run that failed to clip it
+                    size = download_path.stat().st_size
+                else:
+                    size = fetch(
+                        pool,
+                        path,
+                        download_path,
+                        buffer_size,
+                        retries,
+                        segments,
+                        segment_size,
+                        controller,
+                    )
+            if shared:
+                try:
+                    store.put(file_name, download_path)
+                except OSError as e:
+                    print(f"{Colors.warning}Not stored: {Colors.end}{file_name}: {e}")
+        if clip_bbox is not None:
+            clip.clip_hdf(download_path, outpath, clip_bbox, clip_nodata)
+            download_path.unlink()
+        manifest.finish(path, size, time.time() - start)
+        print(
+            f"{Colors.ok}Complete: {Colors.end}{time.time() - start:.2f}s",
+            file_name,
+        )
+        if on_complete is not None:
+            on_complete(path, outpath)
+    except Exception as e:
+        # if error record the failure in the manifest for download later
         print(f"{Colors.error}Failed to download: {Colors.end}{file_name}")
-        with open(logfile, "a") as f:
-            print(f"{path}\n", file=f)
+        manifest.fail(path, repr(e))
+
+
+def enqueue_file_urls(
+    paths: list, file_queue: queue.Queue, cancel: threading.Event = None
+) -> None:
+    """
+    Put already known file urls on the download queue followed by the end of
+    queue marker
+
+    Args:
+        paths
+        file_queue
+        cancel: Set when the downloads stopped
+    """
+    for path in paths + [None]:
+        if not put_file_url(file_queue, path, cancel):
+            return
+
+
+def consume_file_urls(
+    file_queue: queue.Queue,
+    outdir: Union[str, Path],
+    manifest: Manifest,
+    *args,
+    cancel: threading.Event = None,
+    **kwargs,
+) -> int:
+    """
+    Consumer half of the download pipeline. Downloads file urls from
+    ``file_queue`` until the end of queue marker is reached, which is put
+    back for the remaining consumers.
+
+    A url whose download raises is recorded as failed in the manifest and
+    the next one is taken. If the consumer itself fails ``cancel`` is set,
+    which stops the producer and the other consumers instead of leaving
+    them waiting on the queue.
+
+    Args:
+        file_queue
+        outdir
+        manifest
+        *args, **kwargs: Passed on to downloader after the manifest
+        cancel: Set when the downloads stop, checked while waiting on the
+            queue
+
+    Returns:
+        int: Number of urls taken from the queue
+    """
+    count = 0
+    try:
+        while True:
+            try:
+                path = file_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    return count
+                continue
+            if path is None:
+                file_queue.put(None)
+                return count
+            try:
+                downloader(path, outdir, manifest, *args, **kwargs)
+            except Exception as e:
+                print(f"{Colors.error}Failed to download: {Colors.end}{path}: {e!r}")
+                manifest.fail(path, repr(e))
+            count += 1
+    except BaseException:
+        if cancel is not None:
+            cancel.set()
+        raise
 
 
 def main():
+    # Dispatch to the other commands, downloading is the default
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = importlib.import_module(f".{sys.argv[1]}", __package__)
+        return command.main(sys.argv[2:])
+
     start = time.time()
 
     # Parse
@@ -151,8 +669,34 @@ def main():
     outdir = Path(args.outdir)
     tiles = args.tiles
     years = args.years
-    logfile = args.log
-    processes = args.processes
+    workers = args.workers
+    list_concurrency = args.list_concurrency
+    if args.cog and args.clip_bbox is not None:
+        print("--cog and --clip-bbox cannot be used together")
+        return
+
+    # Check the optional dependencies before anything is listed, instead of
+    # failing every download
+    if args.clip_bbox is not None:
+        try:
+            from . import clip
+        except ImportError as e:
+            print(f"--clip-bbox requires numpy and GDAL's python bindings: {e}")
+            return
+    if args.cog:
+        try:
+            from osgeo import gdal
+        except ImportError as e:
+            print(f"--cog requires GDAL's python bindings: {e}")
+            return
+
+    # Nodes sharing an output tree each keep their own databases
+    node = ""
+    if args.shard:
+        node = ".{0}of{1}".format(*args.shard)
+    elif args.work_queue:
+        node = f".{socket.gethostname()}"
+    listing_cache = Path(args.listing_cache or outdir / f"listings{node}.db")
 
     # Make individual directories
     outdir.mkdir(parents=True, exist_ok=True)
@@ -163,18 +707,124 @@ def main():
     land_dir = outdir / "L30"
     land_dir.mkdir(parents=True, exist_ok=True)
 
-    # Construct file url  lists
-    dir_urls = construct_dir_urls(SENSORS, tiles, years)
-    file_urls = construct_file_urls(dir_urls)
-
-    # Create processing pool
-    pool = mp.Pool(processes)
-    print(f"Total files found: {len(file_urls)}")
-    print(f"Using {mp.cpu_count()} threads")
-    # Split processes
-    pool.starmap(
-        downloader, [(file_urls[i], outdir, logfile) for i in range(len(file_urls))]
+    manifest = Manifest(args.manifest or outdir / f"manifest{node}.db")
+
+    # Full granules only pass through scratch space when clipping
+    scratch = None
+    if args.clip_bbox is not None:
+        scratch = Path(args.scratch or outdir / "scratch")
+        scratch.mkdir(parents=True, exist_ok=True)
+
+    # Convert HDF files to COGs as they complete, alongside the downloads
+    converter = None
+    on_complete = None
+    if args.cog:
+        from .cog import Converter
+
+        converter = Converter(
+            manifest,
+            args.cog_dir or outdir / "COG",
+            args.cog_processes,
+            args.cog_compress,
+            args.cog_predictor,
+            args.cog_blocksize,
+        )
+
+        def on_complete(url, path):
+            if path.suffix == ".hdf":
+                converter.submit(url, path)
+
+    store = None
+    if args.store:
+        store = GranuleStore(args.store, args.store_budget)
+
+    # List directories in the background, feeding a bounded queue. Both
+    # halves of the pipeline stop once cancel is set.
+    file_queue = queue.Queue(maxsize=args.queue_depth)
+    cancel = threading.Event()
+    lister = ThreadPoolExecutor(max_workers=1)
+    cache = ListingCache(listing_cache, args.listing_ttl)
+    if args.retry_failed:
+        # Downloads still running were cut off by a run that was killed
+        retry = sorted(manifest.urls(FAILED) + manifest.urls(RUNNING))
+        listing = lister.submit(enqueue_file_urls, retry, file_queue, cancel)
+    else:
+        dir_urls = construct_dir_urls(SENSORS, tiles, years)
+        claim = release = None
+        if args.work_queue:
+            work_queue = WorkQueue(args.work_queue)
+            claim, release = work_queue.claim, work_queue.release
+            if args.shard:
+                dir_urls = steal_order(dir_urls, *args.shard)
+        elif args.shard:
+            dir_urls = shard_urls(dir_urls, *args.shard)
+        listing = lister.submit(
+            produce_file_urls,
+            dir_urls,
+            file_queue,
+            list_concurrency,
+            cache,
+            claim,
+            release,
+            args.clip_bbox is None,
+            cancel,
+        )
+
+    # Download with worker threads sharing one pool of keep-alive
+    # connections, starting as soon as the first files are listed. The
+    # controller decides how many of the workers may download at once.
+    def log_concurrency(limit, rate, reason):
+        print(
+            f"{Colors.cyan}Concurrency: {Colors.end}{limit} workers "
+            f"({rate / 1e6:.1f} MB/s, {reason})"
+        )
+        manifest.log_concurrency(limit, rate, reason)
+
+    pool = ConnectionPool(maxsize=args.per_host or workers)
+    controller = AIMDController(
+        workers, args.initial_workers, log=log_concurrency, fixed=args.fixed_workers
     )
+    print(f"Using up to {workers} workers, starting with {controller.limit}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        consumers = [
+            executor.submit(
+                consume_file_urls,
+                file_queue,
+                outdir,
+                manifest,
+                pool,
+                controller,
+                buffer_size=args.buffer_size,
+                retries=args.retries,
+                segments=args.segments,
+                segment_size=args.segment_size,
+                clip_bbox=args.clip_bbox,
+                clip_nodata=args.clip_nodata,
+                scratch=scratch,
+                on_complete=on_complete,
+                store=store,
+                cancel=cancel,
+            )
+            for _ in range(workers)
+        ]
+        try:
+            total = sum(consumer.result() for consumer in consumers)
+        except BaseException:
+            cancel.set()
+            raise
+    pool.close()
+    lister.shutdown()
+    cache.close()
+    if store is not None:
+        store.close()
+    if converter is not None:
+        # Pick up files downloaded earlier that were never converted. Nodes
+        # sharing the tree only take the files of their own manifest
+        converter.submit_pending(outdir, recorded_only=bool(node))
+        converter.close()
+    manifest.close()
+    print(f"Total files found: {total}")
+    listing.result()
     print("Total time: ", time.time() - start)
 
 
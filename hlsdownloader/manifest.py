@@ -0,0 +1,163 @@
+##############################################################################
+# Author: Owen Smith
+# Title: manifest.py
+##############################################################################
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def find_manifest(indir: Union[str, Path]) -> Path:
+    """
+    Manifest of a download directory: manifest.db, or the manifest of the
+    only node that downloaded into it (manifest.KofN.db or manifest.<host>.db)
+
+    Raises:
+        ValueError: If several nodes kept their manifests in the directory
+    """
+    indir = Path(indir)
+    path = indir / "manifest.db"
+    nodes = sorted(indir.glob("manifest.*.db"))
+    if path.exists() or not nodes:
+        return path
+    if len(nodes) > 1:
+        names = ", ".join(node.name for node in nodes)
+        raise ValueError(
+            f"Several node manifests in {indir} ({names}), pick one with -m"
+        )
+    return nodes[0]
+
+
+class Manifest:
+    """
+    Transactional record of every granule file a run has tried to download.
+
+    Each url is stored with its status, size, download duration, number of
+    attempts and last error. The set of completed urls is read with a single
+    indexed query when the manifest is opened so skip decisions do not need
+    to touch the output tree.
+
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS granules ("
+            "url TEXT PRIMARY KEY, name TEXT, status TEXT, bytes INTEGER, "
+            "duration REAL, attempts INTEGER DEFAULT 0, last_error TEXT, "
+            "updated REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS granules_status ON granules (status)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "url TEXT, stage TEXT, status TEXT, error TEXT, updated REAL, "
+            "PRIMARY KEY (url, stage))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS concurrency ("
+            "time REAL, workers INTEGER, throughput REAL, reason TEXT)"
+        )
+        self._db.commit()
+        self._done = set(self.urls(DONE))
+
+    def urls(self, status: str) -> list:
+        """
+        All urls with the given status
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url FROM granules WHERE status = ? ORDER BY url", (status,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def sizes(self) -> dict:
+        """
+        Downloaded size of every completed file by file name
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, bytes FROM granules WHERE status = ?", (DONE,)
+            ).fetchall()
+        return dict(rows)
+
+    def is_done(self, url: str) -> bool:
+        return url in self._done
+
+    def _update(self, url: str, sql: str, params: tuple) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO granules (url, name) VALUES (?, ?)",
+                (url, url.split("/")[-1]),
+            )
+            self._db.execute(
+                f"UPDATE granules SET {sql}, updated = ? WHERE url = ?",
+                params + (time.time(), url),
+            )
+
+    def start(self, url: str) -> None:
+        self._update(url, "status = ?, attempts = attempts + 1", (RUNNING,))
+
+    def finish(self, url: str, size: int, duration: float = None) -> None:
+        self._update(
+            url,
+            "status = ?, bytes = ?, duration = ?, last_error = NULL",
+            (DONE, size, duration),
+        )
+        self._done.add(url)
+        # Products derived from an earlier copy of the file are out of date
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM stages WHERE url = ?", (url,))
+
+    def fail(self, url: str, error: str) -> None:
+        self._update(url, "status = ?, last_error = ?", (FAILED, error))
+
+    def stage_urls(self, stage: str, status: str = DONE) -> set:
+        """
+        Urls whose processing ``stage`` has the given status
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url FROM stages WHERE stage = ? AND status = ?",
+                (stage, status),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record_stage(
+        self, url: str, stage: str, status: str, error: str = None
+    ) -> None:
+        """
+        Record the outcome of a processing stage run on a downloaded file
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)",
+                (url, stage, status, error, time.time()),
+            )
+
+    def log_concurrency(self, workers: int, throughput: float, reason: str) -> None:
+        """
+        Record a change to the number of concurrent downloads
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO concurrency VALUES (?, ?, ?, ?)",
+                (time.time(), workers, throughput, reason),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
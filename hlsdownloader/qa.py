@@ -0,0 +1,219 @@
+##############################################################################
+# Author: Owen Smith
+# Title: qa.py
+##############################################################################
+
+import argparse
+import csv
+import multiprocessing as mp
+from itertools import groupby
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from osgeo import gdal
+
+from .hlsdownloader import Colors
+
+gdal.UseExceptions()
+
+# Bits of the v1.4 QA band, the same for S30 and L30. Bits 6-7 hold the
+# aerosol quality.
+BITS = {"cirrus": 0, "cloud": 1, "adjacent": 2, "shadow": 3, "snow": 4, "water": 5}
+FILL = 255
+
+MASKS = ["cloud", "shadow", "snow", "water"]
+EXCLUDE = ["cirrus", "cloud", "adjacent", "shadow", "snow"]
+COUNTS = ["valid", "clear"] + MASKS
+
+
+def parser(argv: list) -> argparse.Namespace:
+    """
+    Command line argument parser
+    """
+    pargs = argparse.ArgumentParser(
+        prog="hlsdownloader qa",
+        description="Decode the QA band of downloaded HLS v1.4 HDF files and "
+        "count valid, clear, cloud, shadow, snow and water observations per "
+        "pixel of every tile",
+    )
+    pargs.add_argument(
+        "-i",
+        "--indir",
+        required=True,
+        help="Output directory of hlsdownloader holding the S30 and L30 folders",
+    )
+    pargs.add_argument(
+        "-o", "--outdir", help="Directory for the summaries (default: INDIR/qa)"
+    )
+    pargs.add_argument(
+        "-t", "--tiles", nargs="+", help="Only summarize these tiles, e.g. 17SPA"
+    )
+    pargs.add_argument(
+        "-e",
+        "--exclude",
+        nargs="+",
+        default=EXCLUDE,
+        choices=list(BITS),
+        help="Flags that make an observation not clear (default: %(default)s)",
+    )
+    pargs.add_argument(
+        "--masks",
+        action="store_true",
+        help="Also write the cloud, shadow, snow and water masks of every file",
+    )
+    pargs.add_argument(
+        "-p",
+        "--processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of tiles to summarize at once",
+    )
+    return pargs.parse_args(argv)
+
+
+def granule_tile(path: Path) -> str:
+    return path.name.split(".")[2]
+
+
+def flags(names: list) -> int:
+    """
+    Bit mask of QA flags
+    """
+    return sum(1 << BITS[name] for name in names)
+
+
+def decode(qa: np.ndarray, names: list = MASKS) -> dict:
+    """
+    Boolean masks of QA flags
+
+    Args:
+        qa: QA band, any shape, uint8
+        names: Flags to decode, keys of BITS
+
+    Returns:
+        dict: Mask of every flag, False at fill values
+    """
+    valid = qa != FILL
+    return {name: (qa & flags([name]) != 0) & valid for name in names}
+
+
+def clear(qa: np.ndarray, exclude: list = EXCLUDE) -> np.ndarray:
+    """
+    Mask of valid observations with none of the ``exclude`` flags set
+    """
+    return (qa & flags(exclude) == 0) & (qa != FILL)
+
+
+def read_qa(path: Union[str, Path]) -> gdal.Dataset:
+    """
+    Open the QA subdataset of an HDF file
+    """
+    for name, _ in gdal.Open(str(path)).GetSubDatasets():
+        if name.split(":")[-1].upper() == "QA":
+            return gdal.Open(name)
+    raise ValueError(f"{Path(path).name} has no QA subdataset")
+
+
+def write_bands(
+    outpath: Union[str, Path], stack: np.ndarray, names: list, like: gdal.Dataset
+) -> None:
+    """
+    Write a stack of arrays as a compressed GeoTIFF on the grid of ``like``
+    """
+    dtype = gdal.GDT_UInt16 if stack.dtype == np.uint16 else gdal.GDT_Byte
+    out = gdal.GetDriverByName("GTiff").Create(
+        str(outpath),
+        stack.shape[2],
+        stack.shape[1],
+        stack.shape[0],
+        dtype,
+        options=["COMPRESS=DEFLATE", "TILED=YES"],
+    )
+    out.SetGeoTransform(like.GetGeoTransform())
+    out.SetProjection(like.GetProjection())
+    for i, name in enumerate(names):
+        band = out.GetRasterBand(i + 1)
+        band.WriteArray(stack[i])
+        band.SetDescription(name)
+    out.FlushCache()
+    out = None
+
+
+def summarize_tile(args: tuple) -> tuple:
+    """
+    Decode the QA band of every file of one tile, keeping only per pixel
+    counts of each class and one QA band in memory
+
+    Args:
+        args: Tile, its HDF files, output directory, flags excluded from
+            clear observations and whether to write masks
+
+    Returns:
+        tuple: Tile, one row of pixel counts per file and a list of errors
+    """
+    tile, files, outdir, exclude, masks = args
+    counts = None
+    like = None
+    rows = []
+    errors = []
+    for path in files:
+        try:
+            ds = read_qa(path)
+            qa = ds.GetRasterBand(1).ReadAsArray()
+            if counts is None:
+                counts = np.zeros((len(COUNTS),) + qa.shape, dtype=np.uint16)
+                like = ds
+            elif qa.shape != counts.shape[1:]:
+                raise ValueError(f"QA is {qa.shape}, the tile {counts.shape[1:]}")
+        except (RuntimeError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+            continue
+        row = {"granule": path.name, "tile": tile}
+        decoded = decode(qa)
+        layers = [qa != FILL, clear(qa, exclude)] + [decoded[name] for name in MASKS]
+        for name, mask, total in zip(COUNTS, layers, counts):
+            total += mask
+            row[name] = int(np.count_nonzero(mask))
+        rows.append(row)
+        if masks:
+            write_bands(
+                Path(outdir) / "masks" / f"{path.stem}_masks.tif",
+                np.stack(layers[2:]).view(np.uint8),
+                MASKS,
+                ds,
+            )
+    if counts is not None:
+        write_bands(Path(outdir) / f"{tile}_counts.tif", counts, COUNTS, like)
+    return tile, rows, errors
+
+
+def main(argv: list = None) -> None:
+    args = parser(argv)
+    indir = Path(args.indir)
+    outdir = Path(args.outdir or indir / "qa")
+    outdir.mkdir(parents=True, exist_ok=True)
+    if args.masks:
+        (outdir / "masks").mkdir(exist_ok=True)
+
+    tiles = {f"T{tile}" for tile in args.tiles} if args.tiles else None
+    files = sorted(indir.glob("S30/*.hdf")) + sorted(indir.glob("L30/*.hdf"))
+    files = [p for p in files if not tiles or granule_tile(p) in tiles]
+    files.sort(key=granule_tile)
+    tasks = [
+        (name, list(tile_files), outdir, args.exclude, args.masks)
+        for name, tile_files in groupby(files, key=granule_tile)
+    ]
+
+    report = outdir / "qa_summary.csv"
+    count = 0
+    with mp.Pool(args.processes) as pool, open(report, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["granule", "tile"] + COUNTS)
+        writer.writeheader()
+        for name, rows, errors in pool.imap_unordered(summarize_tile, tasks):
+            writer.writerows(rows)
+            count += len(rows)
+            for error in errors:
+                print(f"{Colors.error}Failed to decode: {Colors.end}{error}")
+            print(f"{Colors.ok}Summarized: {Colors.end}{name} ({len(rows)} files)")
+    print(f"Decoded {count} files. Counts in {outdir}, per file in {report}")
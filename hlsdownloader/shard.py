@@ -0,0 +1,114 @@
+##############################################################################
+# Author: Owen Smith
+# Title: shard.py
+##############################################################################
+
+import argparse
+import hashlib
+import os
+import socket
+from pathlib import Path
+from typing import Union
+from urllib.parse import urlsplit
+
+
+def parse_shard(value: str) -> tuple:
+    """
+    Argument type for shards given as K/N, with 1 <= K <= N
+    """
+    try:
+        index, count = (int(i) for i in value.split("/"))
+        if 1 <= index <= count:
+            return index, count
+    except ValueError:
+        pass
+    msg = "not a valid shard: {0!r}; use K/N with 1 <= K <= N".format(value)
+    raise argparse.ArgumentTypeError(msg)
+
+
+def unit_key(url: str) -> str:
+    """
+    Stable hash of a sensor/year/tile directory url. Only the path is used so
+    every node computes the same key regardless of the host name.
+    """
+    return hashlib.sha1(urlsplit(url).path.encode()).hexdigest()
+
+
+def shard_urls(dir_urls: list, index: int, count: int) -> list:
+    """
+    Directory urls belonging to shard ``index`` of ``count``
+
+    Units are ordered by their hash and dealt out round robin, so every unit
+    lands in exactly one shard and shard sizes differ by at most one. The
+    input order is kept.
+
+    Args:
+        dir_urls
+        index: 1 based shard number
+        count
+
+    Returns:
+        list
+    """
+    ranked = sorted(set(dir_urls), key=unit_key)
+    mine = {url for i, url in enumerate(ranked) if i % count == index - 1}
+    return [url for url in dir_urls if url in mine]
+
+
+def steal_order(dir_urls: list, index: int, count: int) -> list:
+    """
+    All directory urls with those of shard ``index`` first, followed by the
+    other shards starting with the next one, so idle nodes spread out over
+    the leftover work
+
+    Args:
+        dir_urls
+        index
+        count
+
+    Returns:
+        list
+    """
+    ordered = []
+    for offset in range(count):
+        ordered.extend(shard_urls(dir_urls, (index - 1 + offset) % count + 1, count))
+    return ordered
+
+
+class WorkQueue:
+    """
+    Lock file based claims on directory urls in a directory shared by every
+    node. A unit is claimed by atomically creating its lock file, so only
+    one node ever lists and downloads a given directory. A claim is only
+    released when its directory could not be listed, so another node can
+    take it over; otherwise use a fresh directory for each batch run.
+
+    Args:
+        directory: Shared queue directory
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def claim(self, url: str) -> bool:
+        """
+        Claim a directory url, returns False if another node already has
+        """
+        try:
+            fd = os.open(
+                self.directory / f"{unit_key(url)}.claim",
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+            )
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            print(self.owner, url, file=f)
+        return True
+
+    def release(self, url: str) -> None:
+        """
+        Give up the claim on a directory url so it can be claimed again
+        """
+        (self.directory / f"{unit_key(url)}.claim").unlink(missing_ok=True)
@@ -0,0 +1,199 @@
+##############################################################################
+# Author: Owen Smith
+# Title: store.py
+##############################################################################
+
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+BUDGET = "1T"
+
+# ioctl request cloning one file into another on Linux (btrfs, XFS)
+FICLONE = 0x40049409
+
+size_regex = re.compile(r"^(\d+(?:\.\d+)?)([KMGT]?)B?$", re.IGNORECASE)
+units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value: str) -> int:
+    """
+    Argument type for byte sizes such as 500G or 2T
+    """
+    match = size_regex.match(value.strip())
+    if match is None:
+        msg = "not a valid size: {0!r}; use e.g. 500G or 2T".format(value)
+        raise argparse.ArgumentTypeError(msg)
+    number, unit = match.groups()
+    return int(float(number) * units[unit.upper()])
+
+
+def reflink(src: Union[str, Path], dst: Union[str, Path]) -> None:
+    """
+    Create ``dst`` as a copy on write clone of ``src``
+    """
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_file(src: Union[str, Path], dst: Union[str, Path]) -> str:
+    """
+    Place ``src`` at ``dst`` without copying its data where the filesystem
+    allows it: a hard link, else a reflink, else a plain copy. ``dst`` is
+    written under a temporary name and renamed, so it is never seen
+    incomplete.
+
+    Returns:
+        str: "hardlink", "reflink" or "copy"
+    """
+    tmp = Path(f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError:
+            # Different filesystem or links not supported
+            try:
+                reflink(src, tmp)
+                method = "reflink"
+            except (ImportError, OSError):
+                shutil.copyfile(src, tmp)
+                method = "copy"
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return method
+
+
+class GranuleStore:
+    """
+    Download cache shared by every output directory on a machine or cluster.
+
+    Files are stored once under ``objects/`` keyed by file name and size, and
+    placed into output trees with link_file, so projects downloading the same
+    granules share both the transfer and, on one filesystem, the disk space.
+    Files are hard linked, so they must not be modified in place. An SQLite
+    index in the store directory records when each file was last used; the
+    least recently used files are evicted once the store holds more than
+    ``budget`` bytes. The index may be shared by several processes.
+
+    Args:
+        directory: Store directory
+        budget: Maximum number of bytes kept
+    """
+
+    def __init__(self, directory: Union[str, Path], budget: int):
+        self.directory = Path(directory)
+        self.budget = budget
+        (self.directory / "objects").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(self.directory / "index.db"), timeout=60, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "key TEXT PRIMARY KEY, name TEXT, size INTEGER, added REAL, used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS objects_used ON objects (used)")
+        self._db.commit()
+
+    def object_path(self, key: str) -> Path:
+        return self.directory / "objects" / key
+
+    @staticmethod
+    def key(name: str, size: int) -> str:
+        return f"{name}.{size}"
+
+    def get(self, name: str, size: int, outpath: Union[str, Path]) -> bool:
+        """
+        Place the stored copy of a file at ``outpath``
+
+        Returns:
+            bool: False if the store does not hold the file with this size
+        """
+        key = self.key(name, size)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size FROM objects WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return False
+        try:
+            if self.object_path(key).stat().st_size != size:
+                raise FileNotFoundError(key)
+            link_file(self.object_path(key), outpath)
+        except FileNotFoundError:
+            # Evicted by another process, or removed by hand
+            self._forget([key])
+            return False
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE objects SET used = ? WHERE key = ?", (time.time(), key)
+            )
+        return True
+
+    def put(self, name: str, path: Union[str, Path]) -> None:
+        """
+        Add a downloaded file to the store, evicting the least recently used
+        files if the store grows past its budget
+        """
+        size = Path(path).stat().st_size
+        key = self.key(name, size)
+        link_file(path, self.object_path(key))
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                (key, name, size, now, now),
+            )
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used files until the store fits its budget
+
+        Returns:
+            int: Number of files removed
+        """
+        with self._lock, self._db:
+            # Take the write lock up front so processes do not evict the
+            # same files twice
+            self._db.execute("BEGIN IMMEDIATE")
+            (total,) = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM objects"
+            ).fetchone()
+            evicted = []
+            if total > self.budget:
+                for key, size in self._db.execute(
+                    "SELECT key, size FROM objects ORDER BY used"
+                ):
+                    evicted.append(key)
+                    total -= size
+                    if total <= self.budget:
+                        break
+                self._db.executemany(
+                    "DELETE FROM objects WHERE key = ?", [(k,) for k in evicted]
+                )
+        for key in evicted:
+            self.object_path(key).unlink(missing_ok=True)
+        return len(evicted)
+
+    def _forget(self, keys: list) -> None:
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM objects WHERE key = ?", [(k,) for k in keys]
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,287 @@
+##############################################################################
+# Author: Owen Smith
+# Title: transfer.py
+##############################################################################
+
+import http.client
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Union
+from urllib.error import HTTPError
+
+from .connection import ConnectionPool
+
+BUFFER_SIZE = 1024 * 1024
+RETRIES = 3
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+content_range_regex = re.compile(r"bytes (?:\d+-\d+|\*)/(\d+)")
+
+
+def part_path(outpath: Union[str, Path]) -> Path:
+    """
+    Path of the partial file a download is written to before it is complete
+    """
+    return Path(f"{outpath}.part")
+
+
+def segments_path(part: Path) -> Path:
+    """
+    Path of the file recording which segments of a partial file are complete
+    """
+    return Path(f"{part}.segments")
+
+
+def total_size(resp: http.client.HTTPResponse) -> Union[int, None]:
+    """
+    Full size of the remote file from Content-Range or Content-Length
+    """
+    match = content_range_regex.match(resp.getheader("Content-Range") or "")
+    if match:
+        return int(match.group(1))
+    length = resp.getheader("Content-Length")
+    if resp.status == 200 and length is not None:
+        return int(length)
+    return None
+
+
+def retryable(error: Exception) -> bool:
+    """
+    Whether a failed transfer is worth another attempt. Network errors,
+    truncated bodies, throttling and server errors are; other http errors
+    are not.
+    """
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def fetch(
+    pool: ConnectionPool,
+    url: str,
+    outpath: Union[str, Path],
+    buffer_size: int = BUFFER_SIZE,
+    retries: int = RETRIES,
+    segments: int = 1,
+    segment_size: int = SEGMENT_SIZE,
+    controller=None,
+) -> int:
+    """
+    Stream a url to disk in ``buffer_size`` chunks over a pooled connection
+
+    Data is written to ``outpath.part``. If the transfer fails, or a partial
+    file is left over from an earlier run, the download resumes from the end
+    of the partial file with a Range request. The partial file is renamed to
+    ``outpath`` only once its size matches the size reported by the server.
+
+    With ``segments`` above one, files larger than ``segment_size`` on
+    servers that accept byte ranges are split into ``segment_size`` ranges,
+    up to ``segments`` of which are fetched concurrently and written in
+    place.
+
+    Args:
+        pool
+        url
+        outpath
+        buffer_size
+        retries: Number of times a failed transfer is resumed
+        segments: Maximum number of concurrent ranges per file
+        segment_size: Size in bytes of each range
+        controller: Told about transferred bytes and failed attempts through
+            its ``record`` and ``congestion`` methods
+
+    Returns:
+        int: Size of the downloaded file
+    """
+    part = part_path(outpath)
+    record = controller.record if controller is not None else lambda n: None
+    for attempt in range(retries + 1):
+        try:
+            total = None
+            if segments > 1:
+                total = _probe(pool, url)
+            if total is not None and total > segment_size:
+                size = _fetch_segments(
+                    pool,
+                    url,
+                    part,
+                    total,
+                    buffer_size,
+                    segments,
+                    segment_size,
+                    record,
+                )
+            else:
+                size = _fetch_part(pool, url, part, buffer_size, record)
+            os.replace(part, outpath)
+            return size
+        except Exception as e:
+            if controller is not None:
+                controller.congestion(e)
+            if attempt == retries or not retryable(e):
+                raise
+            time.sleep(2**attempt)
+
+
+def remote_size(pool: ConnectionPool, url: str) -> Union[int, None]:
+    """
+    Size of the remote file from a HEAD request, None if it cannot be told
+    """
+    try:
+        with pool.request(url, method="HEAD") as resp:
+            resp.read()
+            length = resp.getheader("Content-Length")
+            if resp.status != 200 or length is None:
+                return None
+            return int(length)
+    except (OSError, http.client.HTTPException):
+        return None
+
+
+def _probe(pool: ConnectionPool, url: str) -> Union[int, None]:
+    """
+    Size of the remote file if the server accepts byte ranges. Errors are
+    left for the download request itself to report.
+    """
+    with pool.request(url, method="HEAD") as resp:
+        resp.read()
+        if resp.status != 200:
+            return None
+        if resp.getheader("Accept-Ranges", "").lower() != "bytes":
+            return None
+        length = resp.getheader("Content-Length")
+        return int(length) if length is not None else None
+
+
+def _fetch_part(
+    pool: ConnectionPool, url: str, part: Path, buffer_size: int, record: Callable
+) -> int:
+    offset = part.stat().st_size if part.exists() else 0
+    if segments_path(part).exists():
+        # Left by a segmented download, the data is not contiguous
+        segments_path(part).unlink()
+        offset = 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with pool.request(url, headers=headers) as resp:
+        total = total_size(resp)
+        if resp.status == 416 and total is not None and offset == total:
+            # The partial file was already complete
+            resp.read()
+            return offset
+        if resp.status == 416:
+            # The partial file is larger than the remote, start over
+            resp.read()
+            part.unlink()
+            raise http.client.IncompleteRead(b"")
+        if resp.status not in (200, 206):
+            resp.read()
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
+        # Servers that ignore Range send the whole file again
+        mode = "ab" if resp.status == 206 and offset else "wb"
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        with open(part, mode) as f:
+            while True:
+                n = resp.readinto(buffer)
+                if not n:
+                    break
+                f.write(view[:n])
+                record(n)
+
+    size = part.stat().st_size
+    if total is not None and size != total:
+        raise http.client.IncompleteRead(b"", total - size)
+    return size
+
+
+def _fetch_segments(
+    pool: ConnectionPool,
+    url: str,
+    part: Path,
+    total: int,
+    buffer_size: int,
+    segments: int,
+    segment_size: int,
+    record: Callable,
+) -> int:
+    done_path = segments_path(part)
+    if done_path.exists() and part.exists():
+        done = {int(start) for start in done_path.read_text().split()}
+    elif part.exists():
+        # Contiguous partial file from a single stream download
+        offset = part.stat().st_size
+        done = set(range(0, offset - segment_size + 1, segment_size))
+    else:
+        done = set()
+    if not part.exists():
+        part.touch()
+    os.truncate(part, total)
+
+    starts = [start for start in range(0, total, segment_size) if start not in done]
+    lock = threading.Lock()
+    fd = os.open(part, os.O_RDWR)
+    try:
+
+        def fetch_segment(start):
+            end = min(start + segment_size, total) - 1
+            _fetch_range(pool, url, fd, start, end, buffer_size, lock, record)
+            with lock, open(done_path, "a") as f:
+                print(start, file=f)
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for future in [executor.submit(fetch_segment, s) for s in starts]:
+                future.result()
+    finally:
+        os.close(fd)
+
+    done_path.unlink()
+    return total
+
+
+def _fetch_range(
+    pool: ConnectionPool,
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    buffer_size: int,
+    lock: threading.Lock,
+    record: Callable,
+) -> None:
+    with pool.request(url, headers={"Range": f"bytes={start}-{end}"}) as resp:
+        if resp.status != 206:
+            resp.read()
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+        buffer = bytearray(min(buffer_size, end - start + 1))
+        view = memoryview(buffer)
+        offset = start
+        while offset <= end:
+            n = resp.readinto(buffer)
+            if not n:
+                break
+            pwrite(fd, view[:n], offset, lock)
+            record(n)
+            offset += n
+    if offset != end + 1:
+        raise http.client.IncompleteRead(b"", end + 1 - offset)
+
+
+def pwrite(fd: int, data: memoryview, offset: int, lock: threading.Lock) -> None:
+    """
+    Write all of ``data`` at ``offset`` without moving a shared file position
+    """
+    if not hasattr(os, "pwrite"):
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                data = data[os.write(fd, data) :]
+        return
+    while data:
+        n = os.pwrite(fd, data, offset)
+        data = data[n:]
+        offset += n
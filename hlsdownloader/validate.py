@@ -0,0 +1,246 @@
+##############################################################################
+# Author: Owen Smith
+# Title: validate.py
+##############################################################################
+
+import argparse
+import json
+import multiprocessing as mp
+import struct
+from pathlib import Path
+from typing import Union
+
+from .hlsdownloader import Colors, granule_url
+from .manifest import Manifest, find_manifest
+
+HDF4_MAGIC = b"\x0e\x03\x13\x01"
+DFTAG_NULL = 1
+
+# Number of subdatasets in a complete v1.4 granule of each sensor
+SUBDATASETS = {"S30": 14, "L30": 11}
+
+
+def parser(argv: list) -> argparse.Namespace:
+    """
+    Command line argument parser
+    """
+    pargs = argparse.ArgumentParser(
+        prog="hlsdownloader validate",
+        description="Check downloaded v1.4 HLS HDF files for truncation, size "
+        "mismatches and missing subdatasets",
+    )
+    pargs.add_argument(
+        "-i",
+        "--indir",
+        required=True,
+        help="Output directory of hlsdownloader holding the S30 and L30 folders",
+    )
+    pargs.add_argument(
+        "-r",
+        "--report",
+        help="JSON report of every checked file (default: INDIR/validation.json)",
+    )
+    pargs.add_argument(
+        "-m",
+        "--manifest",
+        help="Download manifest to compare sizes against and requeue broken "
+        "files in (default: INDIR/manifest.db, or the only manifest.<node>.db "
+        "there)",
+    )
+    pargs.add_argument(
+        "--requeue",
+        action="store_true",
+        help="Delete broken files and mark them as failed in the manifest so "
+        "'hlsdownloader --retry-failed' downloads them again",
+    )
+    pargs.add_argument(
+        "-p",
+        "--processes",
+        default=mp.cpu_count(),
+        type=int,
+        help="Number of processes to check files with",
+    )
+    return pargs.parse_args(argv)
+
+
+def read_dds(path: Union[str, Path]) -> list:
+    """
+    Read the data descriptors of an HDF4 file
+
+    Args:
+        path
+
+    Returns:
+        list: (tag, ref, offset, length) of every data descriptor
+    """
+    dds = []
+    with open(path, "rb") as f:
+        if f.read(4) != HDF4_MAGIC:
+            raise ValueError("not an HDF4 file")
+        offset = 4
+        seen = set()
+        while offset and offset not in seen:
+            seen.add(offset)
+            f.seek(offset)
+            header = f.read(6)
+            if len(header) < 6:
+                raise ValueError(f"data descriptor block at {offset} is truncated")
+            ndds, offset = struct.unpack(">hi", header)
+            block = f.read(12 * ndds)
+            if len(block) < 12 * ndds:
+                raise ValueError("data descriptor block is truncated")
+            dds.extend(struct.iter_unpack(">HHii", block))
+    return dds
+
+
+def count_subdatasets(path: Union[str, Path]) -> Union[int, None]:
+    """
+    Number of subdatasets GDAL finds in a file, None if GDAL is not installed
+    """
+    try:
+        from osgeo import gdal
+    except ImportError:
+        return None
+    gdal.UseExceptions()
+    ds = gdal.Open(str(path))
+    return len(ds.GetSubDatasets())
+
+
+def check_file(args: tuple) -> dict:
+    """
+    Check a single HDF file
+
+    The data descriptor headers are read directly to make sure every object
+    they point at lies inside the file, which catches truncated downloads.
+    The size is compared against the manifest, the subdatasets are counted
+    with GDAL and the .hdr file next to it must exist.
+
+    Args:
+        args: Path of the file and the size recorded in the manifest or None
+
+    Returns:
+        dict
+    """
+    path, expected_size = args
+    sensor = path.name.split(".")[1]
+    result = {
+        "path": str(path),
+        "sensor": sensor,
+        "size": path.stat().st_size,
+        "expected_size": expected_size,
+        "subdatasets": None,
+        "expected_subdatasets": SUBDATASETS.get(sensor),
+        "hdr": Path(f"{path}.hdr").exists(),
+        "errors": [],
+    }
+    errors = result["errors"]
+
+    if expected_size is not None and result["size"] != expected_size:
+        errors.append(f"size {result['size']} does not match {expected_size}")
+
+    try:
+        for tag, ref, offset, length in read_dds(path):
+            if tag != DFTAG_NULL and length > 0 and offset + length > result["size"]:
+                errors.append(f"object {tag}/{ref} ends past the end of the file")
+                break
+    except (OSError, ValueError) as e:
+        errors.append(str(e))
+
+    if not errors:
+        try:
+            result["subdatasets"] = count_subdatasets(path)
+        except RuntimeError as e:
+            errors.append(str(e))
+        expected = result["expected_subdatasets"]
+        if result["subdatasets"] is not None and result["subdatasets"] != expected:
+            errors.append(f"{result['subdatasets']} subdatasets, expected {expected}")
+
+    if not result["hdr"]:
+        errors.append("missing .hdr file")
+    result["ok"] = not errors
+    return result
+
+
+def validate(
+    indir: Union[str, Path], manifest: Manifest = None, processes: int = 1
+) -> list:
+    """
+    Check every HDF file under the S30 and L30 folders of ``indir``
+
+    Args:
+        indir
+        manifest
+        processes
+
+    Returns:
+        list: One result per file as returned by check_file
+    """
+    indir = Path(indir)
+    sizes = manifest.sizes() if manifest is not None else {}
+    files = sorted(indir.glob("S30/*.hdf")) + sorted(indir.glob("L30/*.hdf"))
+    with mp.Pool(processes) as pool:
+        return pool.map(
+            check_file,
+            [(path, sizes.get(path.name)) for path in files],
+            chunksize=16,
+        )
+
+
+def requeue(results: list, manifest: Manifest) -> int:
+    """
+    Delete broken files and mark them as failed in the manifest. Only the
+    .hdr file is requeued if it is the one missing.
+
+    Args:
+        results
+        manifest
+
+    Returns:
+        int: Number of files requeued
+    """
+    count = 0
+    for result in results:
+        if result["ok"]:
+            continue
+        path = Path(result["path"])
+        files = [Path(f"{path}.hdr")]
+        if len(result["errors"]) > (not result["hdr"]):
+            files.append(path)
+        for broken in files:
+            manifest.fail(granule_url(broken.name), "; ".join(result["errors"]))
+            if broken.exists():
+                broken.unlink()
+        count += 1
+    return count
+
+
+def main(argv: list = None) -> None:
+    args = parser(argv)
+    indir = Path(args.indir)
+    report = Path(args.report or indir / "validation.json")
+    try:
+        manifest_path = Path(args.manifest or find_manifest(indir))
+    except ValueError as e:
+        print(f"{Colors.error}{e}{Colors.end}")
+        return
+    manifest = None
+    if manifest_path.exists() or args.requeue:
+        manifest = Manifest(manifest_path)
+
+    results = validate(indir, manifest, args.processes)
+    with open(report, "w") as f:
+        json.dump(results, f, indent=2)
+
+    broken = [result for result in results if not result["ok"]]
+    for result in broken:
+        errors = "; ".join(result["errors"])
+        print(f"{Colors.error}{result['path']}: {Colors.end}{errors}")
+    if results and all(result["subdatasets"] is None for result in results):
+        print(f"{Colors.warning}GDAL not installed, skipped subdatasets{Colors.end}")
+    print(f"Checked {len(results)} files, {len(broken)} broken. Report: {report}")
+
+    if args.requeue and broken:
+        count = requeue(broken, manifest)
+        print(f"Requeued {count} files, run hlsdownloader with --retry-failed")
+    if manifest is not None:
+        manifest.close()
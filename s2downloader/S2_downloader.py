@@ -13,10 +13,9 @@
 #' request images and wait for them). Note that Google does not do their own L2A conversion - all L2A images
 #' are supplied directly from Copernicus (true as of November 2022).
 #'
-#' Running this function requires Google Cloud Storage SDK, which you can download and install
-#' from \href{https://cloud.google.com/sdk/docs/install}{here}. For your first time attempting to run the function
-#' you will need to open a python or terminal script and run `gcloud auth login`, which will take you to log in to your
-#' google account.
+#' Products are downloaded directly from the public bucket, which needs no credentials.
+#' For other buckets set GCS_OAUTH_TOKEN to an access token, e.g. from
+#' `gcloud auth print-access-token` of the \href{https://cloud.google.com/sdk/docs/install}{Google Cloud SDK}.
 #'
 #' Note: L2A data is provided since October 2016 and global since January 2017;
 #' if you need to go further back then that then you will have to process L1 data
@@ -25,16 +24,42 @@
 ##############
 # Import packages
 import argparse
-from pathlib import Path
+import json
 import os
-import subprocess
-from datetime import date, timedelta
-import pandas as pd
+from pathlib import Path
+import re
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from typing import NamedTuple
 import geopandas as gpd
 
+from catalog import Catalog
+from metadata import fetch_quality
+from scheduler import WORKERS, download_products
+from storage import get_client, list_many
+from tileindex import TileIndex
+
 ##############
 # Constants
 URL = "gs://gcp-public-data-sentinel-2/L2/tiles"
+PRODUCT = "MSIL2A"
+# First year of products of each satellite
+SATELLITES = {"S2A": 2015, "S2B": 2017, "S2C": 2024}
+# Above this many name prefixes per tile the whole tile directory is listed
+MAX_PREFIXES = 24
+# Products can appear in the bucket days after sensing, so a sync lists the
+# dates this long before the end of the previous listing again
+SYNC_OVERLAP = timedelta(days=14)
+
+# Matched against the name of a product, the sensing date being characters
+# 11 to 19 of it
+product_regex = re.compile(
+    r"S2[A-D]_MSIL2A_(\d{4})(\d{2})(\d{2})T(\d{2})(\d{2})(\d{2})_N(\d{4})_R\d{3}_"
+    r"T(\w{5})_\d{8}T\d{6}\.SAFE/?$"
+)
+# Band and resolution of a JP2 image or mask, e.g. ..._B02_10m.jp2
+jp2_regex = re.compile(r"_([A-Z0-9]+)_(\d{2})m\.jp2$")
+band_regex = re.compile(r"^([A-Z0-9]+?)(?:_(\d{2})M?)?$")
 
 #############
 # Misc
@@ -46,6 +71,21 @@ class Colors:
     end = "\033[0m"
 
 
+class Product(NamedTuple):
+    """
+    A .SAFE product directory listed for a tile
+    """
+
+    sensing: datetime
+    tile: str
+    baseline: str
+    url: str
+
+    @property
+    def name(self) -> str:
+        return self.url.rstrip("/").split("/")[-1]
+
+
 #############
 # Core
 def parser():
@@ -65,230 +105,572 @@ def parser():
         "-i", 
         "--input_aoi", 
         type=str, 
-        help="Path to geojson aoi"
+        nargs="+",
+        help="Paths to geojson aois, or directories of them. Tiles and products "
+        "shared by several aois are listed and downloaded once"
     )
     pargs.add_argument(
         "-s", 
         "--start", 
         type=str, 
-        help="Start date in the form YYYY-MM-DD",
+        help="Start date in the form YYYY-MM-DD (with --sync, default: the "
+        "earliest date already listed in the catalog)",
     )
     pargs.add_argument(
         "-e", 
         "--end", 
         type=str, 
-        help="End date in the form YYYY-MM-DD",
+        help="End date in the form YYYY-MM-DD (with --sync, default: today)",
+    )
+    pargs.add_argument(
+        "--sync",
+        action="store_true",
+        help="Keep a catalog of the products of every tile in OUTDIR/catalog.db, "
+        "only list dates after the previous sync and only download products "
+        "not downloaded yet",
     )
-    return pargs.parse_args()
+    pargs.add_argument(
+        "--list-concurrency",
+        type=int,
+        default=8,
+        help="Number of tiles to list at once",
+    )
+    pargs.add_argument(
+        "-b",
+        "--bands",
+        nargs="+",
+        help="Only download these bands, e.g. B02 B8A SCL CLDPRB, at every "
+        "resolution kept by --resolution, or at one resolution, e.g. B11_20m. "
+        "Metadata files are always downloaded",
+    )
+    pargs.add_argument(
+        "-r",
+        "--resolution",
+        nargs="+",
+        type=int,
+        choices=[10, 20, 60],
+        help="Only download images at these resolutions in meters",
+    )
+    pargs.add_argument(
+        "--max-cloud",
+        type=float,
+        help="Skip products with a larger cloud percentage, read from their "
+        "metadata before downloading",
+    )
+    pargs.add_argument(
+        "--max-nodata",
+        type=float,
+        help="Skip products with a larger no data percentage",
+    )
+    pargs.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="Number of files downloaded at once, across all products",
+    )
+    pargs.add_argument(
+        "--storage-root",
+        type=str,
+        help="Local directory to read gs:// urls from instead of Google Cloud "
+        "Storage, gs://bucket/path being STORAGE_ROOT/bucket/path",
+    )
+    args = pargs.parse_args()
+    if not args.sync and not (args.start and args.end):
+        pargs.error("-s/--start and -e/--end are required without --sync")
+    return args
+
+def aoi_paths(inputs: list) -> list:
+    """
+    AOI files given on the command line, directories replaced by the .geojson
+    files in them
+
+    Args:
+        inputs
+
+    Returns:
+        list
+    """
+    paths = []
+    for entry in map(Path, inputs):
+        if entry.is_dir():
+            paths.extend(sorted(entry.glob("*.geojson")))
+        else:
+            paths.append(entry)
+    return paths
 
-def identify_tiles(aoi_path: str, mgrs_path: str) -> list:
+
+def identify_tiles(aoi_path: str, mgrs_path: str, index: TileIndex = None) -> list:
     """
-    Identify tiles to download
+    Identify tiles to download, looking them up in the cached index of the
+    MGRS tiles, which is built from mgrs_path on first use
 
     Args:
         aoi_path
         mgrs_path
+        index: Index already opened, to look up several aois
 
     Returns:
         list
     """
 
-    # Load mgrs geojson
-    mgrs_geo = gpd.read_file(mgrs_path)
-    mgrs_geo = mgrs_geo.set_crs("EPSG:4326")
-
     # Load aoi geojson
     aoi_geo = gpd.read_file(aoi_path)
-    aoi_geo = aoi_geo.set_crs("EPSG:4326")
+    if aoi_geo.crs is None:
+        aoi_geo = aoi_geo.set_crs("EPSG:4326")
+    aoi_geo = aoi_geo.to_crs("EPSG:4326")
 
     # Find tiles where they intersect
-    tiles = list(gpd.overlay(mgrs_geo, aoi_geo, how = "intersection")['Name'].unique())
+    if index is None:
+        index = TileIndex.open(mgrs_path)
+    tiles = index.query(aoi_geo.geometry.values)
 
     return(tiles)
-  
-def construct_file_urls(tiles: list) -> list:
+
+def date_prefixes(start_date: str, end_date: str) -> list:
     """
-    Construct the urls for S2 file directories
+    Product name prefixes covering the sensing dates from start_date up to,
+    not including, end_date: one per satellite in orbit and month, or per
+    year for years covered entirely. Falls back to listing everything ([""]) when
+    that takes more than MAX_PREFIXES requests.
 
     Args:
-        tiles
+        start_date
+        end_date
 
     Returns:
         list
     """
-    # Initiate list of file urls
-    file_urls = []
-
-    # Check for multiple tiles, run w/ 1 tile
-    if len(tiles) == 1:
-        tile = tiles[0]
-        # Dir structure
-        file_list = f"{URL}/{tile[0:2]}/{tile[2]}/{tile[3:5]}"
-        # Create gsutil command
-        com = f"gsutil ls {file_list}"
-        # Get file urls
-        proc = os.popen(com).read().strip()
-        result_items = proc.split("\n")
-
-        # Append to list
-        file_urls.append(result_items)
-
-    # Run with multiple tiles
-    elif len(tiles) > 1:
-        for tile in tiles:
-            # Dir structure
-            file_list = f"{URL}/{tile[0:2]}/{tile[2]}/{tile[3:5]}"
-            # Create gsutil command
-            com = f"gsutil ls {file_list}"
-            # Get file urls
-            proc = os.popen(com).read().strip()
-            result_items = proc.split("\n")
-
-            # Append to list
-            file_urls.append(result_items)
+    first = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date) - timedelta(days=1)
+    months = [
+        (year, month)
+        for year in range(first.year, last.year + 1)
+        for month in range(1, 13)
+        if (first.year, first.month) <= (year, month) <= (last.year, last.month)
+    ]
+    periods = []
+    for year, year_months in groupby(months, key=lambda ym: ym[0]):
+        year_months = list(year_months)
+        if len(year_months) == 12:
+            periods.append(f"{year}")
+        else:
+            periods.extend(f"{year}{month:02d}" for _, month in year_months)
+
+    prefixes = [
+        f"{sat}_{PRODUCT}_{period}"
+        for sat, launch in SATELLITES.items()
+        for period in periods
+        if int(period[:4]) >= launch
+    ]
+    if not prefixes or len(prefixes) > MAX_PREFIXES:
+        return [""]
+    return prefixes
+
+
+def construct_file_urls(
+    tiles: list,
+    client=None,
+    concurrency: int = 8,
+    start_date: str = None,
+    end_date: str = None,
+) -> list:
+    """
+    Construct the urls for S2 file directories, listing tiles concurrently.
+    Given a date range, only products whose names start with a matching
+    sensing month are listed.
 
-    else:
+    Args:
+        tiles
+        client: Storage client, Google Cloud Storage by default
+        concurrency
+        start_date
+        end_date
+
+    Returns:
+        list: One list of .SAFE directory urls per tile
+    """
+    if not tiles:
         print(f"{Colors.error}Error parsing tiles, check tiles input!")
+        return []
+
+    if client is None:
+        client = get_client()
 
-    return file_urls
+    prefixes = None
+    if start_date and end_date:
+        prefixes = date_prefixes(start_date, end_date)
 
+    # Dir structure
+    dir_urls = [f"{URL}/{tile[0:2]}/{tile[2]}/{tile[3:5]}" for tile in tiles]
 
-def query_by_date(start_date: str, end_date: str, file_urls: list) -> str:
+    return list_many(client, dir_urls, concurrency, prefixes)
+
+
+def sync_catalog(
+    tiles: list,
+    catalog: Catalog,
+    client=None,
+    concurrency: int = 8,
+    start_date: str = None,
+    end_date: str = None,
+) -> int:
     """
-    Query dates to keep only images within specified date range
+    Add the products of every tile sensed from start_date up to, not
+    including, end_date to the catalog, listing for each tile only the dates
+    after its previous listing, less SYNC_OVERLAP
 
     Args:
-        start_date 
+        tiles
+        catalog
+        client: Storage client, Google Cloud Storage by default
+        concurrency
+        start_date
         end_date
-        file_urls
 
     Returns:
-        list
+        int: Number of new products
+    """
+    starts = {}
+    for tile in tiles:
+        starts[tile] = start_date
+        listed = catalog.listed_range(tile)
+        if listed is not None and listed[0] <= start_date <= listed[1]:
+            since = date.fromisoformat(listed[1]) - SYNC_OVERLAP
+            starts[tile] = max(start_date, since.isoformat())
+
+    added = 0
+    tiles = sorted(tiles, key=starts.get)
+    for tile_start, group in groupby(tiles, key=starts.get):
+        if tile_start >= end_date:
+            continue
+        group = list(group)
+        file_urls = construct_file_urls(
+            group, client, concurrency, tile_start, end_date
+        )
+        for tile, tile_urls in zip(group, file_urls):
+            products = parse_products(
+                tile_urls,
+                date.fromisoformat(tile_start),
+                date.fromisoformat(end_date),
+            )
+            added += catalog.add(products)
+            catalog.record_listing(tile, tile_start, end_date)
+    return added
+
+
+def parse_products(urls: list, sdate: date = None, edate: date = None) -> list:
     """
+    Parse listed urls into Product records sorted by sensing time, skipping
+    anything that is not a .SAFE product. With sdate and edate, only products
+    sensed from sdate up to, not including, edate are kept; the dates are
+    compared as strings in the names first, so only the products of the
+    range are matched and parsed.
 
-    # Turn to date objects
-    sdate = date(int(start_date[0:4]), int(start_date[5:7]), int(start_date[8:10]))
-    edate = date(int(end_date[0:4]), int(end_date[5:7]), int(end_date[8:10]))
+    Args:
+        urls
+        sdate
+        edate
+
+    Returns:
+        list
+    """
+    first, last = "", "99999999"
+    if sdate is not None and edate is not None:
+        first, last = sdate.strftime("%Y%m%d"), edate.strftime("%Y%m%d")
+        # Every name sensed in a year of the range holds the digits the first
+        # and last days of the range in that year share, which a substring
+        # test finds much faster than slicing out the date of every name
+        shared = []
+        final = edate - timedelta(days=1)
+        for year in range(sdate.year, final.year + 1):
+            days = [max(sdate, date(year, 1, 1)), min(final, date(year, 12, 31))]
+            shared.append(
+                "MSIL2A_"
+                + os.path.commonprefix([day.strftime("%Y%m%d") for day in days])
+            )
+        urls = [url for prefix in shared for url in urls if prefix in url]
+    products = []
+    for url in urls:
+        # Name of the product, with its trailing slash if listed with one
+        name = url[url.rfind("/", 0, len(url) - 1) + 1 :]
+        if not first <= name[11:19] < last:
+            continue
+        match = product_regex.match(name)
+        if match is None:
+            continue
+        year, month, day, hour, minute, second, baseline, tile = match.groups()
+        sensing = datetime(
+            int(year), int(month), int(day), int(hour), int(minute), int(second)
+        )
+        products.append(Product(sensing, tile, baseline, url))
+    products.sort(key=lambda product: product.sensing)
+    return products
+
+
+def query_by_date(start_date: str, end_date: str, file_urls: list) -> list:
+    """
+    Query dates to keep only images sensed within the specified date range,
+    end date excluded
 
-    # Generate list of all possible dates
-    dates = pd.date_range(sdate, edate - timedelta(days=1), freq="d")
-    date_char = [date_obj.strftime("%Y%m%d") for date_obj in dates]
+    Args:
+        start_date
+        end_date
+        file_urls
 
-    # Keep any images that match date range
+    Returns:
+        list: Product records sorted by sensing time. A single list for one
+        tile, one list per tile for several.
+    """
 
-    # For one tile
-    if len(file_urls) == 1:
-        s2_links = file_urls[0]
-        keep_dates = [j for j in date_char if all(j not in k for k in s2_links)]
-
-        keep_links = []
-        for i in date_char:
-            for j in s2_links:
-                if i in j:
-                    keep_links.append(j)
-        return keep_links
-
-    # For multiple tiles
-    elif len(file_urls) > 1:
-        tile_links = []
-        for x, tile_urls in enumerate(file_urls):
-            s2_links = file_urls[x]
-            keep_dates = [j for j in date_char if all(j not in k for k in s2_links)]
-
-            keep_links = []
-            for i in date_char:
-                for j in s2_links:
-                    if i in j:
-                        keep_links.append(j)
-            tile_links.append(keep_links)
-
-        return tile_links
+    # Turn to date objects
+    sdate = date.fromisoformat(start_date)
+    edate = date.fromisoformat(end_date)
 
     # If zero links found, return error
-    else:
+    if not file_urls:
         print(f"{Colors.error}Error in query_by_date: no file urls found!")
+        return []
 
+    tile_links = [parse_products(tile_urls, sdate, edate) for tile_urls in file_urls]
 
-def downloader(subset_list: list, tiles: list, outdir: str) -> list:
-    """
-    Download files
+    # For one tile
+    if len(tile_links) == 1:
+        return tile_links[0]
+    return tile_links
 
-    Args:
-        subset_list
-        tiles
 
-    Returns:
-        Downloads S2 data to tile directories
+def flatten_products(subset_list: list, tiles: list) -> list:
     """
+    Products of all tiles in one list, from the result of query_by_date
+    """
+    if len(tiles) > 1:
+        return [product for img_dir in subset_list for product in img_dir]
+    return list(subset_list)
 
-    file_urls = subset_list
 
-    # Download for multiple tiles
+def nest_products(products: list, tiles: list) -> list:
+    """
+    Products in the shape returned by query_by_date, one list per tile for
+    several tiles
+    """
     if len(tiles) > 1:
-        for img_dir in file_urls:
-            for i, image in enumerate(img_dir):
-
-                # Match tile
-                for tile in tiles:
-                    if tile in img_dir[i]:
-                        tile_id = tile
-                    else:
-                        continue
+        return [[p for p in products if p.tile == tile] for tile in tiles]
+    return list(products)
+
+
+def screen_products(
+    subset_list: list,
+    tiles: list,
+    client,
+    cache: Path,
+    max_cloud: float = None,
+    max_nodata: float = None,
+    concurrency: int = WORKERS,
+) -> list:
+    """
+    Drop products that are too cloudy or hold too little data before
+    downloading, judging by their metadata files, which are fetched
+    concurrently and kept in ``cache``. Products whose metadata cannot be
+    read are kept.
 
-                # Create output folder if doesn't exist
-                outpath = outdir / tile_id
-                check = os.path.isdir(outpath)
-                if not check:
-                    os.makedirs(outpath)
-                    print(f"{Colors.cyan}Created folder: {outpath}{Colors.end}")
+    Args:
+        subset_list: As returned by query_by_date
+        tiles
+        client: Storage client
+        cache: Directory keeping the metadata files
+        max_cloud: Largest cloud percentage kept
+        max_nodata: Largest no data percentage kept
+        concurrency
 
+    Returns:
+        list: subset_list without the dropped products
+    """
+    tile_lists = subset_list if len(tiles) > 1 else [subset_list]
+    products = flatten_products(subset_list, tiles)
+    quality = fetch_quality(client, products, cache, concurrency)
+
+    def keep(product):
+        q = quality[product]
+        if q is None:
+            return True
+        if max_cloud is not None and q.cloud is not None and q.cloud > max_cloud:
+            return False
+        if max_nodata is not None and q.nodata is not None and q.nodata > max_nodata:
+            return False
+        return True
+
+    tile_lists = [[p for p in img_dir if keep(p)] for img_dir in tile_lists]
+    kept = sum(len(img_dir) for img_dir in tile_lists)
+    print(
+        f"{Colors.cyan}Kept {kept} of {len(products)} products after cloud "
+        f"screening{Colors.end}"
+    )
+    return tile_lists if len(tiles) > 1 else tile_lists[0]
 
-                # Get clean link
-                file = img_dir[i][0:114]
-                dir_outpath = outdir / tile_id
-                file_outpath = dir_outpath / file[49:114]
 
-                # Check if file has already been downloaded
-                if os.path.exists(file_outpath):
-                    continue
+def file_selector(bands: list = None, resolutions: list = None):
+    """
+    Predicate on paths inside a .SAFE product keeping only the JP2 images of
+    the selected bands and resolutions, along with every metadata file, so the
+    download keeps the layout of the product. Previews and JP2 masks without a
+    resolution are dropped.
 
-                # If not, start downloading
-                print(f"{Colors.ok}Downloading...: {image[49:114]}{Colors.end}")
+    Args:
+        bands: Band names such as B02 or SCL, taken at every resolution in
+            ``resolutions``, or with a resolution such as B11_20m
+        resolutions: Resolutions in meters
 
-                # note '-m' flag issue can happen depending on 
-                # python installation, see https://bugs.python.org/issue33725
-                os.system(f"gsutil -o GSUtil:parallel_process_count=1 -o GSUtil:parallel_thread_count=24 -m cp -r {file}/ {dir_outpath}/.")
+    Returns:
+        function: None if nothing is selected, to download whole products
+    """
+    if not bands and not resolutions:
+        return None
+
+    names = set()
+    exact = set()
+    for band in bands or []:
+        match = band_regex.match(band.upper())
+        if match is None:
+            raise ValueError(f"Not a band: {band}")
+        name, res = match.groups()
+        if res:
+            exact.add((name, int(res)))
+        else:
+            names.add(name)
+
+    def select(path: str) -> bool:
+        if not path.endswith(".jp2"):
+            return True
+        match = jp2_regex.search(path)
+        if match is None:
+            return False
+        name, res = match.group(1), int(match.group(2))
+        if (name, res) in exact:
+            return True
+        if resolutions and res not in resolutions:
+            return False
+        return not bands or name in names
+
+    return select
+
+
+def selection_name(bands: list = None, resolutions: list = None):
+    """
+    Name of a selection of bands and resolutions, kept in the products it
+    leaves incomplete
 
-    # Download for one tile
-    if len(tiles) == 1:
-        img_dir = file_urls
-        for i, image in enumerate(img_dir):
+    Returns:
+        str: None if nothing is selected
+    """
+    if not bands and not resolutions:
+        return None
+    bands = ",".join(sorted(band.upper() for band in bands or []))
+    resolutions = ",".join(str(res) for res in sorted(resolutions or []))
+    return f"bands={bands} resolutions={resolutions}"
+
+
+def downloader(
+    subset_list: list,
+    tiles: list,
+    outdir: str,
+    client=None,
+    workers: int = WORKERS,
+    select=None,
+    on_complete=None,
+    selection: str = None,
+) -> dict:
+    """
+    Download files of all tiles and dates through one transfer scheduler
 
-            # Match tile
-            tile_id = tiles[0]
+    Args:
+        subset_list
+        tiles
+        outdir
+        client: Storage client, Google Cloud Storage by default
+        workers
+        select: Predicate on paths inside a product, see file_selector
+        on_complete: Called with each product found complete, its objects and
+            the selection it holds
+        selection: Name of ``select``, see selection_name
 
-            # Create output folder if doesn't exist
-            outpath = outdir / tile_id
-            check = os.path.isdir(outpath)
-            if not check:
-                os.makedirs(outpath)
-                print(f"{Colors.cyan}Created folder: {outpath}{Colors.end}")
+    Returns:
+        Downloads S2 data to tile directories, returns transfer statistics
+    """
+    outdir = Path(outdir)
+    products = flatten_products(subset_list, tiles)
+
+    # Create output folders if they don't exist
+    for tile_id in sorted({product.tile for product in products}):
+        outpath = outdir / tile_id
+        if not outpath.is_dir():
+            outpath.mkdir(parents=True)
+            print(f"{Colors.cyan}Created folder: {outpath}{Colors.end}")
+
+    if client is None:
+        client = get_client()
+
+    stats = download_products(
+        client,
+        products,
+        outdir,
+        workers,
+        select=select,
+        on_complete=on_complete,
+        selection=selection,
+    )
+    seconds = max(stats["seconds"], 1e-9)
+    print(
+        f"{Colors.ok}Downloaded {stats['products']} products, {stats['objects']} "
+        f"files, {stats['bytes'] / 1e6:.1f} MB in {seconds:.1f} s "
+        f"({stats['objects'] / seconds:.1f} files/s, "
+        f"{stats['bytes'] / 1e6 / seconds:.1f} MB/s){Colors.end}"
+    )
+    if stats["failed"]:
+        print(
+            f"{Colors.error}{stats['failed']} products failed, "
+            f"run again to resume{Colors.end}"
+        )
+    return stats
 
-            # Get clean link
-            file = img_dir[i][0:114]
-            dir_outpath = outdir / tile_id
-            file_outpath = dir_outpath / file[49:114]
 
-            # Check if file has already been downloaded
-            if os.path.exists(file_outpath):
-                continue
+def write_aoi_products(
+    path: Path, aoi_tiles: dict, products: list, outdir: Path
+) -> dict:
+    """
+    Record which downloaded products cover each aoi in a JSON file, adding
+    to the products and aois already recorded there
 
-            # If not, start downloading
-            print(f"{Colors.ok}Downloading...: {image[49:114]}{Colors.end}")
+    Args:
+        path
+        aoi_tiles: Tiles of every aoi
+        products: Product records
+        outdir: Output directory holding one folder per tile
 
-            # note '-m' flag issue can happen depending on 
-            # python installation, see https://bugs.python.org/issue33725
-            os.system(f"gsutil -o GSUtil:parallel_process_count=1 -o GSUtil:parallel_thread_count=24 -m cp -r {file}/ {dir_outpath}/.")
+    Returns:
+        dict: Paths of the products of every aoi, relative to outdir, found
+        in this run
+    """
+    by_tile = {}
+    for product in products:
+        name = f"{product.tile}/{product.name}"
+        if (outdir / name).exists():
+            by_tile.setdefault(product.tile, []).append(name)
+    mapping = {
+        aoi: [name for tile in tiles for name in by_tile.get(tile, [])]
+        for aoi, tiles in aoi_tiles.items()
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    recorded = json.loads(path.read_text()) if path.exists() else {}
+    for aoi, names in mapping.items():
+        known = recorded.get(aoi, [])
+        seen = set(known)
+        recorded[aoi] = known + [name for name in names if name not in seen]
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_text(json.dumps(recorded, indent=2))
+    os.replace(tmp, path)
+    return mapping
 
 
 def main():
@@ -296,21 +678,93 @@ def main():
     # Parse command line arguments
     args = parser()
     outdir = Path(args.outdir)
-    aoi_path = args.input_aoi
+    aois = aoi_paths(args.input_aoi)
     start = args.start
     end = args.end
+    select = file_selector(args.bands, args.resolution)
+    selection = selection_name(args.bands, args.resolution)
 
     # Load mgrs grid
     mgrs_path = "./S2_mgrs_tiles.geojson"
 
-    # Find intersecting tiles
-    tiles = identify_tiles(mgrs_path, aoi_path)
-    # Construct file url lists
-    file_list = construct_file_urls(tiles)
-    # Query images by date range
-    subset_list = query_by_date(start, end, file_list)
+    # Find intersecting tiles, each tile once for all aois
+    index = TileIndex.open(mgrs_path)
+    aoi_tiles = {str(aoi): identify_tiles(aoi, mgrs_path, index) for aoi in aois}
+    tiles = list(dict.fromkeys(t for aoi in aoi_tiles.values() for t in aoi))
+    if len(aois) > 1:
+        print(f"{Colors.cyan}{len(aois)} aois cover {len(tiles)} tiles{Colors.end}")
+    client = get_client(args.storage_root)
+    catalog = None
+    if args.sync:
+        # List new images into the catalog, then take every image not
+        # downloaded yet
+        outdir.mkdir(parents=True, exist_ok=True)
+        catalog = Catalog(outdir / "catalog.db")
+        start = start or catalog.first_listed(tiles)
+        if start is None:
+            print(
+                f"{Colors.error}No tiles listed in {outdir / 'catalog.db'} yet, "
+                f"give the first sync a start date with -s{Colors.end}"
+            )
+            catalog.close()
+            return
+        end = end or (date.today() + timedelta(days=1)).isoformat()
+        added = sync_catalog(tiles, catalog, client, args.list_concurrency, start, end)
+        # Images downloaded with another band selection are completed too.
+        # They are taken back from done first: completing one moves it to
+        # .part, where an interrupted run must find it pending again
+        catalog.reopen(
+            parse_products(catalog.incomplete_urls(tiles, start, end, selection))
+        )
+        pending = parse_products(catalog.pending_urls(tiles, start, end))
+        print(
+            f"{Colors.cyan}{added} new products, {len(pending)} to download"
+            f"{Colors.end}"
+        )
+        subset_list = nest_products(pending, tiles)
+    else:
+        # Construct file url lists
+        file_list = construct_file_urls(
+            tiles, client, args.list_concurrency, start, end
+        )
+        # Query images by date range
+        subset_list = query_by_date(start, end, file_list)
+    # Drop cloudy images
+    if args.max_cloud is not None or args.max_nodata is not None:
+        subset_list = screen_products(
+            subset_list,
+            tiles,
+            client,
+            outdir / ".metadata",
+            args.max_cloud,
+            args.max_nodata,
+            args.workers,
+        )
     # Download images
-    download = downloader(subset_list, tiles, outdir)
+    download = downloader(
+        subset_list,
+        tiles,
+        outdir,
+        client,
+        args.workers,
+        select,
+        catalog.finish if catalog is not None else None,
+        selection,
+    )
+    if catalog is not None:
+        for product in flatten_products(subset_list, tiles):
+            if (outdir / product.tile / product.name).exists():
+                catalog.finish(product)
+            else:
+                catalog.fail([product])
+        catalog.close()
+    # Record the images of each aoi
+    write_aoi_products(
+        outdir / "aoi_products.json",
+        aoi_tiles,
+        flatten_products(subset_list, tiles),
+        outdir,
+    )
 
     print(f"{Colors.cyan}Finished Downloading!{Colors.end}")
 
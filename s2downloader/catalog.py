@@ -0,0 +1,203 @@
+#################################################################################
+# Title: catalog.py
+# Script Purpose: Incremental sync catalog of S2 products for S2_downloader
+#################################################################################
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Union
+
+##############
+# Constants
+LISTED = "listed"
+DONE = "done"
+FAILED = "failed"
+
+
+class Catalog:
+    """
+    Record of the products known for every tile, kept in the output
+    directory so a sync only lists what is new since the last run.
+
+    Each product is stored with its sensing time, total size, newest object
+    generation, local status and the selection it was downloaded with when
+    that left some of its objects out; each downloaded object with its size,
+    generation and CRC32C checksum. For every tile the catalog keeps the
+    date range already listed, whose end is the high-water mark of the tile.
+
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            "name TEXT PRIMARY KEY, tile TEXT, sensing TEXT, baseline TEXT, "
+            "url TEXT, status TEXT, size INTEGER, objects INTEGER, "
+            "generation TEXT, updated REAL, selection TEXT)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(products)")]
+        if "selection" not in columns:
+            # Catalogs written before selections were recorded
+            self._db.execute("ALTER TABLE products ADD COLUMN selection TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS products_tile ON products (tile, sensing)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "product TEXT, path TEXT, size INTEGER, generation TEXT, crc32c TEXT, "
+            "PRIMARY KEY (product, path))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            "tile TEXT PRIMARY KEY, listed_from TEXT, listed_until TEXT, updated REAL)"
+        )
+        self._db.commit()
+
+    def listed_range(self, tile: str) -> tuple:
+        """
+        Dates (YYYY-MM-DD) from which and up to which, not included, the
+        products of a tile have been listed, None if it never was
+        """
+        return self._db.execute(
+            "SELECT listed_from, listed_until FROM tiles WHERE tile = ?", (tile,)
+        ).fetchone()
+
+    def first_listed(self, tiles: list):
+        """
+        Earliest date (YYYY-MM-DD) from which any of the tiles has been
+        listed, None if none of them ever was
+        """
+        marks = ", ".join("?" * len(tiles))
+        return self._db.execute(
+            f"SELECT MIN(listed_from) FROM tiles WHERE tile IN ({marks})", tiles
+        ).fetchone()[0]
+
+    def record_listing(self, tile: str, start: str, end: str) -> None:
+        """
+        Record that a tile was listed from start up to end, merged with the
+        range listed before when the two overlap or meet
+        """
+        listed = self.listed_range(tile)
+        if listed is not None and start <= listed[1] and listed[0] <= end:
+            start, end = min(start, listed[0]), max(end, listed[1])
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (tile, start, end, time.time()),
+            )
+
+    def add(self, products: list) -> int:
+        """
+        Add listed products not in the catalog yet
+
+        Returns:
+            int: Number of products added
+        """
+        with self._db:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO products (name, tile, sensing, baseline, url, "
+                "status, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (p.name, p.tile, p.sensing.isoformat(), p.baseline, p.url,
+                     LISTED, time.time())
+                    for p in products
+                ],
+            )
+            return self._db.total_changes - before
+
+    def pending_urls(self, tiles: list, start: str, end: str) -> list:
+        """
+        Urls of the products of ``tiles`` sensed from start up to, not
+        including, end that are not downloaded yet
+        """
+        marks = ", ".join("?" * len(tiles))
+        rows = self._db.execute(
+            f"SELECT url FROM products WHERE tile IN ({marks}) AND status != ? "
+            "AND sensing >= ? AND sensing < ? ORDER BY sensing",
+            (*tiles, DONE, start, end),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def incomplete_urls(
+        self, tiles: list, start: str, end: str, selection: str = None
+    ) -> list:
+        """
+        Urls of the downloaded products of ``tiles`` sensed from start up to,
+        not including, end that were downloaded with another selection than
+        ``selection``, or with one at all when it is None, so they lack
+        objects a run with ``selection`` wants
+        """
+        marks = ", ".join("?" * len(tiles))
+        rows = self._db.execute(
+            f"SELECT url FROM products WHERE tile IN ({marks}) AND status = ? "
+            "AND sensing >= ? AND sensing < ? AND selection IS NOT NULL "
+            "AND selection IS NOT ? ORDER BY sensing",
+            (*tiles, DONE, start, end, selection),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def reopen(self, products: list) -> None:
+        """
+        Mark downloaded products as not downloaded, before they are taken
+        apart to be completed, so an interrupted run leaves them pending
+        """
+        with self._db:
+            self._db.executemany(
+                "UPDATE products SET status = ?, updated = ? WHERE name = ?",
+                [(LISTED, time.time(), p.name) for p in products],
+            )
+
+    def finish(self, product, blobs: list = None, selection: str = None) -> None:
+        """
+        Mark a product downloaded, along with the objects it holds and the
+        selection they were downloaded with, None if they are all of its
+        objects, if known
+        """
+        if blobs is None:
+            with self._db:
+                self._db.execute(
+                    "UPDATE products SET status = ?, updated = ? WHERE name = ?",
+                    (DONE, time.time(), product.name),
+                )
+            return
+
+        prefix = product.url.rstrip("/") + "/"
+        generations = [blob.generation for blob in blobs if blob.generation]
+        with self._db:
+            self._db.execute("DELETE FROM objects WHERE product = ?", (product.name,))
+            self._db.executemany(
+                "INSERT INTO objects VALUES (?, ?, ?, ?, ?)",
+                [
+                    (product.name, blob.url[len(prefix) :], blob.size,
+                     blob.generation, blob.crc32c)
+                    for blob in blobs
+                ],
+            )
+            self._db.execute(
+                "UPDATE products SET status = ?, size = ?, objects = ?, "
+                "generation = ?, updated = ?, selection = ? WHERE name = ?",
+                (
+                    DONE,
+                    sum(blob.size for blob in blobs),
+                    len(blobs),
+                    max(generations, key=int, default=None),
+                    time.time(),
+                    selection,
+                    product.name,
+                ),
+            )
+
+    def fail(self, products: list) -> None:
+        with self._db:
+            self._db.executemany(
+                "UPDATE products SET status = ?, updated = ? WHERE name = ?",
+                [(FAILED, time.time(), p.name) for p in products],
+            )
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,86 @@
+#################################################################################
+# Title: metadata.py
+# Script Purpose: Read the quality indicators of S2 products for S2_downloader
+#################################################################################
+
+import http.client
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+##############
+# Constants
+METADATA = "MTD_MSIL2A.xml"
+# Tags holding the cloud percentage, the first one found is used
+CLOUD_TAGS = ("Cloud_Coverage_Assessment", "CLOUDY_PIXEL_PERCENTAGE")
+NODATA_TAG = "NODATA_PIXEL_PERCENTAGE"
+
+
+class Quality(NamedTuple):
+    """
+    Cloud and no data percentages of a product, None where not reported
+    """
+
+    cloud: Optional[float]
+    nodata: Optional[float]
+
+
+def parse_quality(path: Path) -> Quality:
+    """
+    Read the cloud and no data percentages from the Quality_Indicators_Info
+    of a product metadata file, ignoring XML namespaces
+    """
+    values = {}
+    for element in ET.parse(path).iter():
+        tag = element.tag.rpartition("}")[2]
+        if tag in CLOUD_TAGS + (NODATA_TAG,) and tag not in values:
+            values[tag] = float(element.text)
+    cloud = next((values[tag] for tag in CLOUD_TAGS if tag in values), None)
+    return Quality(cloud, values.get(NODATA_TAG))
+
+
+def fetch_metadata(client, url: str, cache: Path) -> Path:
+    """
+    Path of the metadata file of a product in ``cache``, downloading it if
+    needed. Product names are never reused, so cached files stay valid.
+    """
+    path = cache / f"{url.rstrip('/').split('/')[-1]}.xml"
+    if not path.is_file():
+        tmp = path.with_name(f"{path.name}.tmp")
+        client.download(f"{url.rstrip('/')}/{METADATA}", tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def fetch_quality(client, products: list, cache: Path, concurrency: int = 24) -> dict:
+    """
+    Quality of several products, fetching their metadata files concurrently
+
+    Args:
+        client: Storage client
+        products: Product records
+        cache: Directory keeping the metadata files
+        concurrency
+
+    Returns:
+        dict: Quality of each product, None if its metadata could not be read
+    """
+    cache.mkdir(parents=True, exist_ok=True)
+
+    def quality(product):
+        try:
+            path = fetch_metadata(client, product.url, cache)
+            try:
+                return parse_quality(path)
+            except (ET.ParseError, ValueError):
+                # Fetch it again next time
+                path.unlink()
+                raise
+        except (OSError, http.client.HTTPException, ET.ParseError, ValueError) as e:
+            print(f"Could not read the metadata of {product.name}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(zip(products, executor.map(quality, products)))
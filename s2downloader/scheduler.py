@@ -0,0 +1,207 @@
+#################################################################################
+# Title: scheduler.py
+# Script Purpose: Transfer scheduler downloading S2 products for S2_downloader
+#################################################################################
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+##############
+# Constants
+WORKERS = 24
+# Empty objects some tools create to mark directories
+FOLDER_SUFFIX = "_$folder$"
+# File naming the selection a product was downloaded with, in products
+# holding only part of their objects
+SELECTION = ".selection"
+
+
+def is_complete(path: Path, size: int) -> bool:
+    return path.is_file() and path.stat().st_size == size
+
+
+def incomplete(path: Path, selection: Optional[str]) -> bool:
+    """
+    Whether a downloaded product holds fewer objects than a run with
+    ``selection`` wants: it was downloaded with another selection, or with
+    one at all when ``selection`` is None
+    """
+    marker = path / SELECTION
+    return marker.is_file() and marker.read_text().strip() != selection
+
+
+def mark_selection(path: Path, selection: Optional[str]) -> None:
+    """
+    Record in a product that only the objects of ``selection`` are there,
+    or that all are when it is None
+    """
+    marker = path / SELECTION
+    if selection is None:
+        marker.unlink(missing_ok=True)
+    else:
+        marker.write_text(f"{selection}\n")
+
+
+def fetch_object(client, url: str, path: Path, size: int) -> Optional[int]:
+    """
+    Download one object to ``path`` unless a complete copy is already there.
+    The object is written under a temporary name and renamed, so ``path``
+    only ever holds complete objects.
+
+    Returns:
+        int: Number of bytes transferred, None if the object was already there
+    """
+    if is_complete(path, size):
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.tmp")
+    size = client.download(url, tmp)
+    os.replace(tmp, path)
+    return size
+
+
+def download_products(
+    client,
+    products: list,
+    outdir: Path,
+    workers: int = WORKERS,
+    concurrency: int = 8,
+    select=None,
+    on_complete=None,
+    selection: str = None,
+) -> dict:
+    """
+    Download .SAFE products through one bounded pool of workers.
+
+    Every product is expanded into its objects, and the objects of all tiles
+    and dates are queued on the same pool, so small products do not leave
+    workers idle and each worker keeps reusing its own connection. Products
+    are listed ``concurrency`` at a time while the first objects download. A
+    product that cannot be listed is counted as failed and the others go on.
+
+    A product is assembled in ``<name>.part`` under its tile directory and
+    renamed once all its objects are in, so a product directory is always
+    complete. Products already there are skipped; an interrupted product is
+    resumed, fetching only the objects it is missing.
+
+    With ``select``, only objects whose path inside the product it accepts
+    are downloaded, keeping the layout of the product. Products left without
+    some of their objects keep the name of the selection, ``selection``, in
+    a SELECTION file. Products downloaded with another selection, or with
+    one when ``select`` is None, are listed again and completed with the
+    objects they do not have yet.
+
+    ``on_complete(product, blobs, selection)`` is called with the Blob
+    records of the objects of every product found complete, downloaded or
+    already there, and the selection it holds, None if it has all objects.
+
+    Args:
+        client: Storage client
+        products: Product records
+        outdir: Output directory holding one folder per tile
+        workers: Number of objects downloaded at once
+        concurrency: Number of products listed at once
+        select: Predicate on the path of an object inside its product
+        on_complete
+        selection: Name of ``select``
+
+    Returns:
+        dict: Number of products, objects and bytes downloaded, products
+        failed and seconds taken
+    """
+    start = time.perf_counter()
+    if select is None:
+        selection = None
+    pending = [
+        p
+        for p in products
+        if not (outdir / p.tile / p.name).exists()
+        or incomplete(outdir / p.tile / p.name, selection)
+    ]
+    stats = {"products": 0, "objects": 0, "bytes": 0, "failed": 0}
+    remaining = {}
+    blobs = {}
+    # Selection of the products not getting all their objects
+    partial = {}
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with ThreadPoolExecutor(max_workers=concurrency) as lister:
+            walks = [lister.submit(client.walk, p.url) for p in pending]
+            for product, walk in zip(pending, walks):
+                try:
+                    objects = walk.result()
+                except Exception as e:
+                    print(f"Failed to list {product.name}: {e}")
+                    stats["failed"] += 1
+                    continue
+                prefix = product.url.rstrip("/") + "/"
+                final = outdir / product.tile / product.name
+                part = final.with_name(f"{product.name}.part")
+                listed = [
+                    (blob, blob.url[len(prefix) :])
+                    for blob in objects
+                    if not blob.url.endswith(FOLDER_SUFFIX)
+                ]
+                objects = [
+                    (blob, name)
+                    for blob, name in listed
+                    if select is None or select(name)
+                ]
+                if not objects:
+                    print(f"No objects found for {product.name}, skipping")
+                    continue
+                blobs[product] = [blob for blob, _ in objects]
+                partial[product] = (
+                    (selection or "") if len(objects) < len(listed) else None
+                )
+                if final.exists():
+                    if all(is_complete(final / n, blob.size) for blob, n in objects):
+                        held = partial.pop(product)
+                        mark_selection(final, held)
+                        if on_complete is not None:
+                            on_complete(product, blobs[product], held)
+                        continue
+                    # Downloaded before with fewer files, complete it
+                    os.replace(final, part)
+                remaining[product] = len(objects)
+                print(f"Downloading...: {product.name} ({len(objects)} objects)")
+                for blob, name in objects:
+                    path = part / name
+                    future = executor.submit(
+                        fetch_object, client, blob.url, path, blob.size
+                    )
+                    futures[future] = (product, blob.url)
+
+        for future in as_completed(futures):
+            product, url = futures[future]
+            try:
+                size = future.result()
+            except Exception as e:
+                print(f"Failed to download {url}: {e}")
+                if remaining.pop(product, None) is not None:
+                    stats["failed"] += 1
+                continue
+            if size is not None:
+                stats["bytes"] += size
+                stats["objects"] += 1
+            if product not in remaining:
+                # Another object of the product failed
+                continue
+            remaining[product] -= 1
+            if remaining[product] == 0:
+                del remaining[product]
+                final = outdir / product.tile / product.name
+                os.replace(final.with_name(f"{product.name}.part"), final)
+                held = partial.pop(product)
+                mark_selection(final, held)
+                stats["products"] += 1
+                print(f"Downloaded: {product.name}")
+                if on_complete is not None:
+                    on_complete(product, blobs[product], held)
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,281 @@
+#################################################################################
+# Title: storage.py
+# Script Purpose: Storage clients listing and fetching gs:// urls for S2_downloader
+#################################################################################
+
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode
+
+##############
+# Constants
+GCS_HOST = "storage.googleapis.com"
+RETRIES = 3
+BUFFER_SIZE = 1024 * 1024
+
+
+class Blob(NamedTuple):
+    """
+    An object found by walk, with the generation and CRC32C checksum
+    identifying its content where the storage reports them
+    """
+
+    url: str
+    size: int
+    generation: Optional[str] = None
+    crc32c: Optional[str] = None
+
+
+def split_url(url: str) -> tuple:
+    """
+    Split a gs:// url into its bucket and object name
+    """
+    bucket, _, name = url[len("gs://") :].partition("/")
+    return bucket, name
+
+
+class GCSClient:
+    """
+    Google Cloud Storage client for the JSON API.
+
+    Every thread keeps one keep-alive HTTPS connection, so concurrent
+    listings reuse connections instead of starting ``gsutil`` for each.
+    Public buckets need no credentials; an OAuth access token (e.g. from
+    ``gcloud auth print-access-token``) can be given for anything else.
+
+    Args:
+        token: OAuth access token
+        timeout
+    """
+
+    def __init__(self, token: str = None, timeout: float = 60):
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPSConnection:
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = http.client.HTTPSConnection(
+                GCS_HOST, timeout=self.timeout
+            )
+        return self._local.conn
+
+    def request(self, path: str) -> http.client.HTTPResponse:
+        """
+        GET a path on the storage host, retrying network and server errors.
+        The response has to be read before the next request.
+        """
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        for attempt in range(RETRIES + 1):
+            try:
+                conn = self._connection()
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                if resp.status == 429 or resp.status >= 500:
+                    resp.read()
+                    raise HTTPError(path, resp.status, resp.reason, resp.headers, None)
+                return resp
+            except (OSError, http.client.HTTPException):
+                self._reset()
+                if attempt == RETRIES:
+                    raise
+                time.sleep(2**attempt)
+
+    def _reset(self) -> None:
+        # Start over on a fresh connection
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.close()
+        self._local.conn = None
+
+    def _pages(self, bucket: str, query: dict):
+        """
+        Pages of an object listing, following page tokens
+        """
+        query = dict(query)
+        while True:
+            resp = self.request(f"/storage/v1/b/{quote(bucket)}/o?{urlencode(query)}")
+            body = resp.read()
+            if resp.status != 200:
+                url = f"gs://{bucket}/{query['prefix']}"
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            page = json.loads(body)
+            yield page
+            if "nextPageToken" not in page:
+                break
+            query["pageToken"] = page["nextPageToken"]
+
+    def list(self, url: str, prefix: str = "") -> list:
+        """
+        List a gs:// directory like ``gsutil ls``: the urls of the objects
+        and subdirectories right below it, subdirectories ending in /. With
+        ``prefix`` only names starting with it are listed, which the server
+        does, like ``gsutil ls url/prefix*``.
+
+        Args:
+            url
+            prefix
+
+        Returns:
+            list
+        """
+        bucket, directory = split_url(url)
+        directory = directory.rstrip("/") + "/"
+        query = {"prefix": directory + prefix, "delimiter": "/"}
+        query["fields"] = "items(name),prefixes,nextPageToken"
+        entries = []
+        for page in self._pages(bucket, query):
+            entries.extend(item["name"] for item in page.get("items", []))
+            entries.extend(page.get("prefixes", []))
+        entries = sorted(name for name in entries if name != directory)
+        return [f"gs://{bucket}/{name}" for name in entries]
+
+    def walk(self, url: str) -> list:
+        """
+        Every object below a gs:// directory, at any depth
+
+        Returns:
+            list: Blob of each object
+        """
+        bucket, directory = split_url(url)
+        query = {"prefix": directory.rstrip("/") + "/"}
+        query["fields"] = "items(name,size,generation,crc32c),nextPageToken"
+        return [
+            Blob(
+                f"gs://{bucket}/{item['name']}",
+                int(item["size"]),
+                item.get("generation"),
+                item.get("crc32c"),
+            )
+            for page in self._pages(bucket, query)
+            for item in page.get("items", [])
+        ]
+
+    def download(self, url: str, path: str) -> int:
+        """
+        Stream an object to ``path``, starting over if the transfer breaks
+
+        Returns:
+            int: Size of the object
+        """
+        bucket, name = split_url(url)
+        request = f"/storage/v1/b/{quote(bucket)}/o/{quote(name, safe='')}?alt=media"
+        for attempt in range(RETRIES + 1):
+            resp = self.request(request)
+            if resp.status != 200:
+                resp.read()
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            try:
+                size = 0
+                buffer = bytearray(BUFFER_SIZE)
+                view = memoryview(buffer)
+                with open(path, "wb") as f:
+                    while True:
+                        n = resp.readinto(buffer)
+                        if not n:
+                            break
+                        f.write(view[:n])
+                        size += n
+                return size
+            except (OSError, http.client.HTTPException):
+                self._reset()
+                if attempt == RETRIES:
+                    raise
+                time.sleep(2**attempt)
+
+
+class LocalClient:
+    """
+    Client serving gs:// urls from a local directory, ``gs://bucket/name``
+    being ``root/bucket/name``. Used for tests and mirrors of the bucket.
+
+    Args:
+        root
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, url: str) -> Path:
+        bucket, name = split_url(url)
+        return self.root / bucket / name
+
+    def list(self, url: str, prefix: str = "") -> list:
+        """
+        List a gs:// directory like ``gsutil ls``, only names starting with
+        ``prefix``
+        """
+        directory = self.path(url)
+        if not directory.is_dir():
+            return []
+        url = url.rstrip("/")
+        return [
+            f"{url}/{entry.name}" + ("/" if entry.is_dir() else "")
+            for entry in sorted(directory.iterdir())
+            if entry.name.startswith(prefix)
+        ]
+
+    def walk(self, url: str) -> list:
+        """
+        Every file below a gs:// directory, at any depth, as Blob records
+        with the modification time as generation
+        """
+        directory = self.path(url)
+        url = url.rstrip("/")
+        blobs = []
+        for path in sorted(directory.rglob("*")):
+            if path.is_file():
+                stat = path.stat()
+                name = path.relative_to(directory).as_posix()
+                blobs.append(Blob(f"{url}/{name}", stat.st_size, str(stat.st_mtime_ns)))
+        return blobs
+
+    def download(self, url: str, path: str) -> int:
+        """
+        Copy a file to ``path``
+        """
+        shutil.copyfile(self.path(url), path)
+        return os.path.getsize(path)
+
+
+def get_client(root: str = None):
+    """
+    LocalClient for ``root`` if given, otherwise a GCSClient using the token
+    in the GCS_OAUTH_TOKEN environment variable if set
+    """
+    if root:
+        return LocalClient(root)
+    return GCSClient(os.environ.get("GCS_OAUTH_TOKEN"))
+
+
+def list_many(client, urls: list, concurrency: int = 8, prefixes: list = None) -> list:
+    """
+    List several gs:// directories concurrently
+
+    Args:
+        client
+        urls
+        concurrency
+        prefixes: Only list names starting with one of these, each listed
+            with its own request
+
+    Returns:
+        list: One sorted listing per url, in the order of ``urls``
+    """
+    prefixes = prefixes or [""]
+    jobs = [(url, prefix) for url in urls for prefix in prefixes]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        listings = list(executor.map(lambda job: client.list(*job), jobs))
+    n = len(prefixes)
+    return [
+        sorted(chain.from_iterable(listings[i * n : (i + 1) * n]))
+        for i in range(len(urls))
+    ]
@@ -0,0 +1,114 @@
+#################################################################################
+# Title: tileindex.py
+# Script Purpose: Cached spatial index of the MGRS tiles for S2_downloader
+#################################################################################
+
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+##############
+# Constants
+VERSION = 1
+
+
+def index_path(mgrs_path: str) -> Path:
+    """
+    Index file kept next to the MGRS tile file
+    """
+    mgrs_path = Path(mgrs_path)
+    return mgrs_path.with_name(f"{mgrs_path.stem}.index.npz")
+
+
+def build_index(mgrs_path: str, path: Path) -> None:
+    """
+    Pack the names, bounding boxes and WKB geometries of the MGRS tiles into
+    one .npz file, written under a temporary name and renamed
+    """
+    mgrs_geo = gpd.read_file(mgrs_path)
+    if mgrs_geo.crs is None:
+        mgrs_geo = mgrs_geo.set_crs("EPSG:4326")
+    geoms = mgrs_geo.to_crs("EPSG:4326").geometry.values
+    wkb = shapely.to_wkb(geoms)
+    offsets = np.cumsum([0] + [len(g) for g in wkb])
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp,
+        version=VERSION,
+        names=mgrs_geo["Name"].to_numpy(dtype=str),
+        bounds=shapely.bounds(geoms),
+        wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8),
+        offsets=offsets,
+    )
+    os.replace(tmp, path)
+
+
+class TileIndex:
+    """
+    MGRS tiles with their bounding boxes in memory and their geometries as
+    WKB, so a lookup only decodes the tiles whose box meets the query.
+
+    Args:
+        names
+        bounds: (xmin, ymin, xmax, ymax) of every tile
+        wkb: Geometries of all tiles, concatenated
+        offsets: Start of every geometry in ``wkb``, and its end
+    """
+
+    def __init__(self, names, bounds, wkb, offsets):
+        self.names = names
+        self.bounds = bounds
+        self.wkb = wkb
+        self.offsets = offsets
+
+    @classmethod
+    def open(cls, mgrs_path: str) -> "TileIndex":
+        """
+        Load the index of an MGRS tile file, building it first if it is
+        missing or older than the tile file
+        """
+        path = index_path(mgrs_path)
+        mtime = Path(mgrs_path).stat().st_mtime
+        stale = not path.exists() or path.stat().st_mtime < mtime
+        if not stale:
+            with np.load(path) as data:
+                stale = int(data["version"]) != VERSION
+        if stale:
+            build_index(mgrs_path, path)
+        with np.load(path) as data:
+            return cls(data["names"], data["bounds"], data["wkb"], data["offsets"])
+
+    def geometries(self, indices: np.ndarray) -> np.ndarray:
+        return shapely.from_wkb(
+            [self.wkb[self.offsets[i] : self.offsets[i + 1]].tobytes() for i in indices]
+        )
+
+    def query(self, geometries) -> list:
+        """
+        Names of the tiles whose interior meets any of ``geometries``, in
+        the order of the tile file. Tiles only touching them are left out.
+
+        Args:
+            geometries: Shapely geometries in EPSG:4326
+
+        Returns:
+            list
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        candidates = np.zeros(len(self.names), dtype=bool)
+        for xmin, ymin, xmax, ymax in shapely.bounds(geometries):
+            candidates |= (
+                (self.bounds[:, 0] <= xmax)
+                & (self.bounds[:, 2] >= xmin)
+                & (self.bounds[:, 1] <= ymax)
+                & (self.bounds[:, 3] >= ymin)
+            )
+        indices = np.flatnonzero(candidates)
+        tiles = self.geometries(indices)[:, np.newaxis]
+        hits = shapely.intersects(tiles, geometries) & ~shapely.touches(
+            tiles, geometries
+        )
+        return self.names[indices[hits.any(axis=1)]].tolist()
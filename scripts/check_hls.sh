@@ -1,19 +1,5 @@
 #!/bin/bash
-S30="S30/*.hdf"
-L30="L30/*.hdf"
-
-echo "Checking Sent 2"
-for s in $S30
-do
-  if ! [ "$(gdalinfo $s | grep SUBDATASET | wc -l)" == 28 ]; then
-    echo $s
-  fi
-done
-
-echo "Checking Landsat 8"
-for l in $L30
-do
-  if ! [ "$(gdalinfo $l | grep SUBDATASET | wc -l)" == 22 ]; then
-    echo $l
-  fi
-done
+# Check the S30 and L30 HDF files of the current directory. See
+# 'hlsdownloader validate -h' for options, e.g. --requeue to have broken
+# files downloaded again with 'hlsdownloader --retry-failed'.
+exec hlsdownloader validate -i . "$@"